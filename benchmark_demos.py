@@ -0,0 +1,370 @@
+"""Runtime regression benchmarks for the demos.
+
+Every selected demo is executed repeatedly, each time in a fresh Python interpreter, and
+the execution time of the whole demo and of each of its code blocks (as split by
+sphinx-gallery) is recorded. Only demos running on local simulators are benchmarked;
+demos using remote services or hardware devices are skipped.
+
+Results are stored in a local history file, keyed by the git revision they were measured
+at. Each run is compared against a baseline revision from the history (by default, the
+most recently measured other revision), and demos whose execution time increased by more
+than ``--threshold`` with a one-sided Welch's t-test p-value below ``--alpha`` are flagged
+as regressions.
+
+Usage:
+
+.. code-block:: console
+
+    make benchmark
+    make benchmark-quick
+
+or, to benchmark selected demos against a given revision,
+
+.. code-block:: console
+
+    python benchmark_demos.py tutorial_vqe tutorial_qaoa_intro --baseline 66a0fb0
+
+The quick mode executes each demo fewer times, with the reduced sizes declared in its
+``sphinx_gallery_smoke`` comment (see :mod:`gallery_smoke`), so that the benchmarks fit in
+the time budget of a CI job. Quick and full results are stored and compared separately.
+"""
+import argparse
+import codeop
+import datetime
+import fnmatch
+import glob
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+DEMO_DIR = os.path.join(SRC_DIR, "demonstrations")
+HISTORY_FILE = os.path.join(SRC_DIR, "_build", "benchmarks", "history.json")
+
+# devices that need network access, a running service or quantum hardware
+REMOTE_DEVICES = re.compile(r"""["'](forest\.(qvm|qpu|wavefunction)|qiskit\.ibmq|braket\.|ionq\.)""")
+
+# number of times each demo is executed
+REPEATS = 5
+QUICK_REPEATS = 2
+
+
+def git_revision():
+    """Git revision of the working tree, with a ``+dirty`` suffix if it has local changes."""
+    try:
+        rev = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=SRC_DIR)
+        status = subprocess.check_output(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=SRC_DIR
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+    return rev.decode().strip() + ("+dirty" if status.strip() else "")
+
+
+def uses_remote_device(demo):
+    """Whether a demo uses a device that is not a local simulator."""
+    with open(demo, "r", encoding="utf-8") as f:
+        return REMOTE_DEVICES.search(f.read()) is not None
+
+
+def select_demos(patterns, filename_pattern="tutorial"):
+    """Demos to benchmark.
+
+    Args:
+        patterns (list[str]): glob patterns of the demo names to benchmark; if empty, all
+            demos matching ``filename_pattern`` are selected
+        filename_pattern (str): regular expression selecting the demos executed by the build
+
+    Returns:
+        list[str]: paths of the selected demos running on local simulators
+    """
+    demos = sorted(glob.glob(os.path.join(DEMO_DIR, "*.py")))
+
+    if patterns:
+        names = [os.path.splitext(os.path.basename(demo))[0] for demo in demos]
+        demos = [
+            demo
+            for demo, name in zip(demos, names)
+            if any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(name + ".py", p) for p in patterns)
+        ]
+    else:
+        demos = [demo for demo in demos if re.search(filename_pattern, demo)]
+
+    selected = []
+
+    for demo in demos:
+        if uses_remote_device(demo):
+            print("skipping {} (uses a remote device)".format(os.path.basename(demo)))
+            continue
+
+        selected.append(demo)
+
+    return selected
+
+
+def run_blocks(demo, out, smoke=False):
+    """Execute a demo block by block, and write the execution times to a JSON file.
+
+    This is run in a fresh interpreter by :func:`run_demo`.
+
+    Args:
+        demo (str): path of the demo
+        out (str): path of the JSON file the timings are written to
+        smoke (bool): whether to use the reduced values of the expensive knobs of the demo
+    """
+    # pylint: disable=import-outside-toplevel,exec-used
+    import matplotlib
+
+    matplotlib.use("agg")
+    from sphinx_gallery.py_source_parser import split_code_and_text_blocks
+
+    import gallery_smoke
+
+    _, script_blocks = split_code_and_text_blocks(demo)
+    knobs = gallery_smoke.smoke_knobs(demo) if smoke else {}
+    compiler = codeop.Compile()
+    namespace = {"__name__": "__main__"}
+    blocks = []
+
+    os.chdir(os.path.dirname(demo))
+    sys.path.append(os.getcwd())
+
+    with open(os.devnull, "w") as devnull:
+        stdout = sys.stdout
+        sys.stdout = devnull
+        start = time.perf_counter()
+
+        try:
+            for label, content, lineno in script_blocks:
+                if label != "code":
+                    continue
+
+                content = gallery_smoke.shrink(content, knobs)
+                # pad the block so that tracebacks refer to the lines of the demo
+                code = compiler("\n" * (lineno - 1) + content, demo, "exec")
+                t = time.perf_counter()
+                exec(code, namespace)
+                blocks.append({"line": lineno, "time": time.perf_counter() - t})
+        finally:
+            sys.stdout = stdout
+
+        total = time.perf_counter() - start
+
+    with open(out, "w") as f:
+        json.dump({"time": total, "blocks": blocks}, f)
+
+
+def run_demo(demo, env=None, smoke=False):
+    """Execute a demo in a fresh interpreter.
+
+    Args:
+        demo (str): path of the demo
+        env (dict[str, str]): additional environment variables
+        smoke (bool): whether to use the reduced values of the expensive knobs of the demo
+
+    Returns:
+        dict: the execution time of the demo and of each of its code blocks
+    """
+    fd, out = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+
+    try:
+        subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--run-blocks", demo, out]
+            + (["--smoke"] if smoke else []),
+            check=True,
+            env=dict(os.environ, MPLBACKEND="agg", **(env or {})),
+        )
+
+        with open(out, "r") as f:
+            return json.load(f)
+    finally:
+        os.remove(out)
+
+
+def load_history(path=HISTORY_FILE):
+    """Load the benchmark history, keyed by mode and then by git revision."""
+    if not os.path.isfile(path):
+        return {}
+
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_history(history, path=HISTORY_FILE):
+    """Save the benchmark history."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, "w") as f:
+        json.dump(history, f, indent=1)
+
+
+def baseline_revision(runs, revision):
+    """Most recently measured revision in the history other than ``revision``, or ``None``."""
+    others = [(run["date"], rev) for rev, run in runs.items() if rev != revision]
+    return max(others)[1] if others else None
+
+
+def compare(current, baseline, alpha=0.05, threshold=0.05):
+    """Compare the execution times of a demo with a baseline.
+
+    Args:
+        current (list[float]): execution times of the demo
+        baseline (list[float]): execution times of the demo at the baseline revision
+        alpha (float): significance level of the one-sided Welch's t-test
+        threshold (float): minimal relative increase of the mean execution time that
+            is considered a regression
+
+    Returns:
+        tuple[float, float, bool]: the relative change of the mean execution time, the
+        p-value of the hypothesis that the demo got slower, and whether it is a regression
+    """
+    from scipy import stats  # pylint: disable=import-outside-toplevel
+
+    change = statistics.mean(current) / statistics.mean(baseline) - 1
+
+    if len(current) < 2 or len(baseline) < 2:
+        return change, float("nan"), False
+
+    t, p = stats.ttest_ind(current, baseline, equal_var=False)
+    # convert the two-sided p-value to the one-sided alternative "current is slower"
+    p = p / 2 if t > 0 else 1 - p / 2
+
+    return change, p, bool(p < alpha and change > threshold)
+
+
+def report(results, baseline_results, alpha, threshold):
+    """Print a comparison of the results with the baseline.
+
+    Returns:
+        list[str]: names of the demos that regressed
+    """
+    regressions = []
+    print()
+    print("{:45} {:>10} {:>10} {:>9} {:>8}".format("demo", "mean (s)", "base (s)", "change", "p"))
+
+    for name, res in sorted(results.items()):
+        mean = statistics.mean(res["times"])
+
+        if name not in baseline_results:
+            print("{:45} {:10.2f} {:>10} {:>9} {:>8}".format(name, mean, "--", "--", "--"))
+            continue
+
+        base = baseline_results[name]["times"]
+        change, p, regressed = compare(res["times"], base, alpha, threshold)
+        print(
+            "{:45} {:10.2f} {:10.2f} {:+8.1%} {:8.3f}{}".format(
+                name, mean, statistics.mean(base), change, p, "  SLOWER" if regressed else ""
+            )
+        )
+
+        if regressed:
+            regressions.append(name)
+
+    return regressions
+
+
+def hot_blocks(block_times, top=3):
+    """Code blocks of a demo with the largest mean execution time.
+
+    Args:
+        block_times (list[list[dict]]): the block timings of each execution of the demo
+        top (int): number of blocks to return
+
+    Returns:
+        list[tuple[int, float]]: the first line and mean execution time of the blocks
+    """
+    times = {}
+
+    for run in block_times:
+        for block in run:
+            times.setdefault(block["line"], []).append(block["time"])
+
+    means = [(line, statistics.mean(t)) for line, t in times.items()]
+    return sorted(means, key=lambda item: item[1], reverse=True)[:top]
+
+
+def main(args=None):
+    """Run the benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("demos", nargs="*", help="glob patterns of the demos to benchmark")
+    parser.add_argument(
+        "--quick", action="store_true", help="execute each demo fewer times, in smoke mode"
+    )
+    parser.add_argument("--repeats", type=int, help="number of executions of each demo")
+    parser.add_argument("--baseline", help="git revision to compare against")
+    parser.add_argument("--alpha", type=float, default=0.05, help="significance level")
+    parser.add_argument(
+        "--threshold", type=float, default=0.05, help="minimal relative slowdown to report"
+    )
+    parser.add_argument("--history", default=HISTORY_FILE, help="path of the history file")
+    parser.add_argument("--run-blocks", nargs=2, metavar=("DEMO", "OUT"), help=argparse.SUPPRESS)
+    parser.add_argument("--smoke", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(args)
+
+    if args.run_blocks:
+        run_blocks(*args.run_blocks, smoke=args.smoke)
+        return 0
+
+    mode = "quick" if args.quick else "full"
+    repeats = args.repeats or (QUICK_REPEATS if args.quick else REPEATS)
+    revision = git_revision()
+    results = {}
+
+    for demo in select_demos(args.demos):
+        name = os.path.splitext(os.path.basename(demo))[0]
+        runs = []
+
+        for i in range(repeats):
+            print("[{}/{}] {}".format(i + 1, repeats, name), flush=True)
+
+            try:
+                runs.append(run_demo(demo, smoke=args.quick))
+            except subprocess.CalledProcessError:
+                print("{} failed to execute".format(name))
+                break
+
+        if len(runs) == repeats:
+            results[name] = {
+                "times": [run["time"] for run in runs],
+                "blocks": [run["blocks"] for run in runs],
+            }
+
+    history = load_history(args.history)
+    runs = history.setdefault(mode, {})
+    run = runs.setdefault(revision, {"results": {}})
+    run["date"] = datetime.datetime.utcnow().isoformat()
+    run["results"].update(results)
+    save_history(history, args.history)
+
+    baseline = args.baseline or baseline_revision(runs, revision)
+    if baseline is not None:
+        matches = [rev for rev in runs if rev.startswith(baseline)]
+        baseline = matches[0] if matches else None
+
+    if baseline is None:
+        print("\nno baseline revision to compare against in {}".format(args.history))
+        baseline_results = {}
+    else:
+        print("\ncomparing {} against {}".format(revision, baseline))
+        baseline_results = runs[baseline]["results"]
+
+    regressions = report(results, baseline_results, args.alpha, args.threshold)
+
+    for name in regressions:
+        blocks = ", ".join(
+            "line {} ({:.2f} s)".format(line, t) for line, t in hot_blocks(results[name]["blocks"])
+        )
+        print("{}: slowest code blocks: {}".format(name, blocks))
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
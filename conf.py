@@ -52,6 +52,8 @@ extensions = [
     "sphinx.ext.ifconfig",
     "sphinx_gallery.gen_gallery",
     "sphinx_sitemap",
+    "gallery_execution",
+    "static_assets",
 ]
 
 
@@ -81,8 +83,64 @@ sphinx_gallery_conf = {
     'backreferences_dir'  : 'backreferences',
     'doc_module'          : ('pennylane'),
     'junit': '../test-results/sphinx-gallery/junit.xml',
+    # strip the sphinx_gallery_* configuration comments from the rendered demos
+    'remove_config_comments': True,
 }
 
+# Number of worker processes used to execute the demos. If larger than 1, the demos
+# are executed in parallel, each in its own process; 0 uses one process per core.
+gallery_jobs = 1
+# Frameworks imported once in a warm interpreter the worker processes are forked from,
+# rather than by every demo; the import time of each is reported in the build log.
+gallery_preload = [
+    "numpy",
+    "scipy",
+    "matplotlib.pyplot",
+    "pennylane",
+    "tensorflow",
+    "torch",
+    "torchvision",
+    "strawberryfields",
+    "cirq",
+    "qiskit",
+    "pyscf",
+]
+
+# Executed demos are cached in this directory, keyed on the demo source, the data files it
+# references and the pinned requirements, so that unchanged demos are never executed again.
+gallery_cache_dir = "_build/gallery_cache"
+gallery_cache_dependencies = ["requirements.txt", "demonstrations/snapshots/{name}.json"]
+# maximum size of the cache (in MB) and number of days unused entries are kept for
+gallery_cache_max_size = 2048
+gallery_cache_max_age = 30
+
+# Profile every executed demo (wall and CPU time, peak memory, device executions and the
+# hottest functions), and write a JSON report next to the junit report.
+gallery_profile = False
+gallery_profile_top = 20
+gallery_profile_report = "../test-results/sphinx-gallery/profile.json"
+
+# Execute the demos with the reduced values of the expensive knobs they declare in a
+# "# sphinx_gallery_smoke = {...}" comment, to quickly check that they run end to end.
+gallery_smoke = False
+
+# Render demos whose code is unchanged since they were last executed (e.g. after a prose-only
+# edit) from their recorded outputs instead of executing them again, and only rewrite the
+# gallery zip archives when their contents changed.
+gallery_incremental = False
+
+# Demos using hardware or remote devices are executed with these devices replaced by the
+# results recorded in their snapshot (see "make record-snapshots"), if they have one.
+# Set to "off" to use the real devices.
+gallery_snapshots = "replay"
+gallery_snapshot_dir = "demonstrations/snapshots"
+
+# Losslessly compress the images of the built website, add WebP variants served through
+# <picture> elements, and refer to fingerprinted copies of them (see "make html-release").
+# Processed images are cached in this directory, keyed on their contents.
+assets_optimize = False
+assets_cache_dir = "_build/asset_cache"
+
 mathjax_path = "https://cdnjs.cloudflare.com/ajax/libs/mathjax/2.7.5/MathJax.js?config=TeX-MML-AM_CHTML"
 
 # Remove warnings that occur when generating the the tutorials
@@ -194,9 +252,10 @@ htmlhelp_basename = "QMLdoc"
 # Example configuration for intersphinx: refer to the Python standard library.
 intersphinx_mapping = {"https://pennylane.readthedocs.io/en/stable/": None}
 
-from custom_directives import CustomGalleryItemDirective, YoutubeItemDirective, CommunityCardDirective, RelatedDirective
+from custom_directives import CustomGalleryItemDirective, YoutubeItemDirective, CommunityCardDirective, RelatedDirective, generate_thumbnails
 
 def setup(app):
+    app.connect("builder-inited", generate_thumbnails)
     app.add_directive("customgalleryitem", CustomGalleryItemDirective)
     app.add_directive("youtube", YoutubeItemDirective)
     app.add_directive("community-card", CommunityCardDirective)
@@ -30,9 +30,12 @@
 from docutils.parsers.rst import Directive, directives
 from docutils.statemachine import StringList
 from docutils import nodes
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
 import re
 import os
-import sphinx_gallery
+import sphinx_gallery.gen_rst
 
 try:
     FileNotFoundError
@@ -56,6 +59,148 @@ GALLERY_TEMPLATE = """
     </div>
 """
 
+THUMBNAIL_DIR = '_static/thumbs'
+THUMBNAIL_SIZE = (400, 280)
+THUMBNAIL_MANIFEST = 'thumbnails.json'
+
+GALLERY_ITEM = re.compile(r'^\.\. customgalleryitem::[ \t]*\n((?:[ \t]+\S.*\n?)*)', re.MULTILINE)
+FIGURE_OPTION = re.compile(r'^[ \t]+:figure:[ \t]*(\S.*?)[ \t]*$', re.MULTILINE)
+
+
+def file_hash(path):
+    """SHA-256 hex digest of the contents of a file."""
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class ThumbnailCache:
+    """Record of the gallery thumbnails generated from each source image.
+
+    A thumbnail is up to date if it exists and was generated at the current thumbnail
+    size from a source image with the same modification time and size or, if these
+    changed, the same contents.
+
+    Args:
+        path (str): path of the JSON manifest of the generated thumbnails
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                self.entries = json.load(f)
+
+    def is_current(self, figname, thumbnail):
+        """Whether the thumbnail of a source image is up to date."""
+        entry = self.entries.get(thumbnail)
+
+        if entry is None or not os.path.isfile(thumbnail):
+            return False
+
+        if entry['source'] != figname or entry['thumbnail_size'] != list(THUMBNAIL_SIZE):
+            return False
+
+        stat = os.stat(figname)
+
+        if entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+            return True
+
+        if entry['sha256'] != file_hash(figname):
+            return False
+
+        # the image was touched without being modified
+        entry.update(mtime=stat.st_mtime, size=stat.st_size)
+        return True
+
+    def record(self, figname, thumbnail):
+        """Record that the thumbnail of a source image was generated."""
+        stat = os.stat(figname)
+        self.entries[thumbnail] = {
+            'source': figname,
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'sha256': file_hash(figname),
+            'thumbnail_size': list(THUMBNAIL_SIZE),
+        }
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        with open(self.path, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+
+
+def thumbnail_path(figname):
+    """Path of the gallery thumbnail of a source image, relative to the source directory."""
+    return os.path.join(THUMBNAIL_DIR, os.path.basename(figname))
+
+
+def make_thumbnail(figname, thumbnail):
+    """Scale a source image to a gallery thumbnail."""
+    sphinx_gallery.gen_rst.scale_image(figname, thumbnail, *THUMBNAIL_SIZE)
+
+
+def gallery_item_figures(srcdir):
+    """Source images of all the customgalleryitem directives in the documentation.
+
+    Args:
+        srcdir (str): the Sphinx source directory
+
+    Returns:
+        set[str]: absolute paths of the existing source images
+    """
+    figures = set()
+
+    for root, dirs, files in os.walk(srcdir):
+        # skip the build, static and hidden directories
+        dirs[:] = [d for d in dirs if not d.startswith(('_', '.'))]
+
+        for fname in files:
+            if not fname.endswith('.rst'):
+                continue
+
+            with open(os.path.join(root, fname), 'r', encoding='utf-8') as f:
+                content = f.read()
+
+            for item in GALLERY_ITEM.finditer(content):
+                for figure in FIGURE_OPTION.findall(item.group(1)):
+                    # same resolution as BuildEnvironment.relfn2path
+                    if figure.startswith('/'):
+                        figname = os.path.join(srcdir, figure.lstrip('/'))
+                    else:
+                        figname = os.path.join(root, figure)
+
+                    if os.path.isfile(figname):
+                        figures.add(os.path.normpath(figname))
+
+    return figures
+
+
+def generate_thumbnails(app):
+    """Generate the out of date gallery thumbnails in a thread pool before the
+    documents are read, so that CustomGalleryItemDirective only has to refer to them."""
+    cache = ThumbnailCache(os.path.join(app.doctreedir, THUMBNAIL_MANIFEST))
+    os.makedirs(os.path.join(app.srcdir, THUMBNAIL_DIR), exist_ok=True)
+
+    pending = []
+    for figname in sorted(gallery_item_figures(app.srcdir)):
+        thumbnail = os.path.join(app.srcdir, thumbnail_path(figname))
+
+        if not cache.is_current(figname, thumbnail):
+            pending.append((figname, thumbnail))
+
+    if pending:
+        with ThreadPoolExecutor() as pool:
+            list(pool.map(lambda args: make_thumbnail(*args), pending))
+
+        for figname, thumbnail in pending:
+            cache.record(figname, thumbnail)
+
+    cache.save()
+    app.thumbnail_cache = cache
+
 
 class CustomGalleryItemDirective(Directive):
     """Create a sphinx gallery style thumbnail.
@@ -72,6 +217,8 @@ class CustomGalleryItemDirective(Directive):
 
     If figure is specified, a thumbnail will be made out of it and stored in
     _static/thumbs. Therefore, consider _static/thumbs as a 'built' directory.
+    Thumbnails are generated by generate_thumbnails when the builder is
+    initialized, and only regenerated here if they are missing or out of date.
     """
 
     required_arguments = 0
@@ -99,14 +246,21 @@ class CustomGalleryItemDirective(Directive):
             if 'figure' in self.options:
                 env = self.state.document.settings.env
                 rel_figname, figname = env.relfn2path(self.options['figure'])
-                thumbnail = os.path.join('_static/thumbs/', os.path.basename(figname))
+                thumbnail = thumbnail_path(figname)
+                thumbnail_file = os.path.join(env.srcdir, thumbnail)
+                cache = getattr(env.app, 'thumbnail_cache', None)
+
+                if cache is None or not cache.is_current(figname, thumbnail_file):
+                    try:
+                        os.makedirs(os.path.dirname(thumbnail_file))
+                    except FileExistsError:
+                        pass
 
-                try:
-                    os.makedirs('_static/thumbs')
-                except FileExistsError:
-                    pass
+                    make_thumbnail(figname, thumbnail_file)
 
-                sphinx_gallery.gen_rst.scale_image(figname, thumbnail, 400, 280)
+                    if cache is not None:
+                        cache.record(figname, thumbnail_file)
+                        cache.save()
             else:
                 thumbnail = '_static/thumbs/code.png'
 
@@ -196,10 +196,13 @@ The Quantum Graph Recurrent Neural Network
 
 import pennylane as qml
 from matplotlib import pyplot as plt
-import numpy as np
+from pennylane import numpy as np
 import scipy
+import scipy.sparse
+from scipy.sparse.linalg import eigsh
 import networkx as nx
 import copy
+import functools
 
 
 ######################################################################
@@ -281,41 +284,39 @@ matrix_params = [[0.56, 1.24, 1.67, -0.79], [-1.44, -1.43, 1.18, -0.93]]
 #
 # Finally,
 # we use this information to generate the matrix form of the
-# Ising model Hamiltonian in the computational basis:
+# Ising model Hamiltonian in the computational basis. Since most of its entries are
+# zero, we construct it directly as a sparse matrix rather than by taking Kronecker
+# products of :math:`2^n \times 2^n` matrices: the :math:`ZZ` and :math:`Z` terms are
+# diagonal in the computational basis, and each :math:`X_i` maps a basis state to the
+# state in which qubit :math:`i` is flipped:
 #
 
 
 def create_hamiltonian_matrix(n, graph, params):
 
-    matrix = np.zeros((2 ** n, 2 ** n))
+    # Eigenvalues of the Pauli-Z on each qubit (columns) for each basis state (rows)
+    states = np.arange(2 ** n)
+    z = 1 - 2 * ((states[:, None] >> (n - 1 - np.arange(n))) & 1)
 
-    # Creates the interaction component of the Hamiltonian
+    # Creates the interaction and bias components of the Hamiltonian
+    diagonal = z @ np.array(params[1], dtype=float)
     for count, i in enumerate(graph.edges):
-        m = 1
-        for j in range(0, n):
-            if i[0] == j or i[1] == j:
-                m = np.kron(m, qml.PauliZ.matrix)
-            else:
-                m = np.kron(m, np.identity(2))
-        matrix += params[0][count] * m
-
-    # Creates the bias components of the matrix
+        diagonal += params[0][count] * z[:, i[0]] * z[:, i[1]]
+
+    matrix = scipy.sparse.diags(diagonal)
+
+    # Creates the transverse field components of the Hamiltonian
     for i in range(0, n):
-        m1 = m2 = 1
-        for j in range(0, n):
-            if j == i:
-                m1 = np.kron(m1, qml.PauliZ.matrix)
-                m2 = np.kron(m2, qml.PauliX.matrix)
-            else:
-                m1 = np.kron(m1, np.identity(2))
-                m2 = np.kron(m2, np.identity(2))
-        matrix += (params[1][i] * m1 + m2)
-
-    return matrix
+        flipped = states ^ (1 << (n - 1 - i))
+        matrix = matrix + scipy.sparse.csr_matrix(
+            (np.ones(2 ** n), (flipped, states)), shape=(2 ** n, 2 ** n)
+        )
+
+    return matrix.tocsr()
 
 # Prints a visual representation of the Hamiltonian matrix
 ham_matrix = create_hamiltonian_matrix(qubit_number, ising_graph, matrix_params)
-plt.matshow(ham_matrix, cmap='hot')
+plt.matshow(ham_matrix.toarray(), cmap='hot')
 plt.show()
 
 
@@ -381,7 +382,7 @@ energy_exp = np.real_if_close(res)
 print(f"Energy Expectation: {energy_exp}")
 
 
-ground_state_energy = np.real_if_close(min(np.linalg.eig(ham_matrix)[0]))
+ground_state_energy = eigsh(ham_matrix, k=1, which="SA")[0][0]
 print(f"Ground State Energy: {ground_state_energy}")
 
 
@@ -403,15 +404,21 @@ print(f"Ground State Energy: {ground_state_energy}")
 # state. This, however, is only half of the information we need. We also require
 # a collection of time-evolved, low-energy states.
 # Evolving the low-energy state forward in time is fairly straightforward: all we
-# have to do is multiply the initial state by a time-evolution unitary. This operation 
-# can be defined as a custom gate in PennyLane:
+# have to do is multiply the initial state by the time-evolution unitary
+# :math:`e^{-i\hat{H}t}`. During the training, quantum data is needed for many
+# different times, but always for the same Hamiltonian and initial state. We therefore
+# diagonalize the target Hamiltonian once, and expand the low-energy state in its
+# eigenbasis: the time evolution then only multiplies each component by a phase
+# :math:`e^{-iE_k t}`:
 #
 
+energies, eigenstates = np.linalg.eigh(ham_matrix.toarray())
+low_energy_components = eigenstates.conj().T @ np.array(low_energy_state)
+
 
-def state_evolve(hamiltonian, qubits, time):
+def target_state(time):
 
-    U = scipy.linalg.expm(-1j* hamiltonian * time)
-    qml.QubitUnitary(U, wires=qubits)
+    return eigenstates @ (np.exp(-1j * energies * time) * low_energy_components)
 
 
 ######################################################################
@@ -533,12 +540,10 @@ nx.draw(new_ising_graph)
 
 def qgrnn(params1, params2, time=None):
 
-    # Prepares the low energy state in the two registers
-    qml.QubitStateVector(np.kron(low_energy_state, low_energy_state), wires=reg1+reg2)
-
-    # Evolves the first qubit register with the time-evolution circuit to
-    # prepare a piece of quantum data
-    state_evolve(ham_matrix, reg1, time)
+    # Prepares a piece of quantum data, the time-evolved low energy state, in the
+    # first qubit register and the low energy state in the second
+    quantum_data = target_state(time)
+    qml.QubitStateVector(np.kron(quantum_data, low_energy_state), wires=reg1+reg2)
 
     # Applies the QGRNN layers to the second qubit register
     depth = time / trotter_step  # P = t/Delta
@@ -580,7 +585,68 @@ max_time = 0.1  # The maximum value of time that can be used for quantum data
 
 
 ######################################################################
-# We then define the negative fidelity cost function:
+# Evaluating the cost function with this circuit would run it :math:`N` times,
+# once for each sampled time, on a register of :math:`2n + 1` qubits. Since
+# we simulate the circuit on a state vector, however, we do not need the
+# second register and the SWAP test to compute the fidelities: they are the
+# squared overlaps between the states of the first register and the QGRNN
+# states. Moreover, the layers of the QGRNN are all the same. The
+# :math:`RZZ` and :math:`RZ` gates multiply each computational basis state
+# by a phase, and the layer of :math:`RX` gates is a fixed matrix. We can
+# therefore apply each layer to the states of all the sampled times at
+# once, stopping for each time when its number of layers is reached:
+#
+
+# Pauli-Z eigenvalues of the qubits (columns) in each computational basis state (rows)
+z = 1 - 2 * ((np.arange(2 ** qubit_number)[:, None] >> np.arange(qubit_number)[::-1]) & 1)
+
+# Eigenvalues of the ZZ terms of the guessed interaction graph
+zz = np.stack(
+    [z[:, i[0] - qubit_number] * z[:, i[1] - qubit_number] for i in new_ising_graph.edges],
+    axis=1,
+)
+
+# Matrix of the layer of RX gates
+rx_layer = functools.reduce(np.kron, [qml.RX(2 * trotter_step, wires=0).matrix] * qubit_number)
+
+
+def qgrnn_fidelities(weight_params, bias_params, times):
+
+    depths = np.array([int(i / trotter_step) for i in times])
+
+    # Phases applied by the RZZ and RZ gates to the computational basis states
+    phases = np.exp(-1j * trotter_step * (np.dot(zz, weight_params) + np.dot(z, bias_params)))
+
+    # Applies the QGRNN layers to one copy of the low energy state per time
+    states = np.tile(low_energy_state, (len(times), 1))
+    for layer in range(0, max(depths)):
+        evolved = np.dot(states * phases, rx_layer.T)
+        states = np.where((depths > layer)[:, None], evolved, states)
+
+    # Calculates the fidelities with the quantum data
+    quantum_data = np.array([target_state(i) for i in times])
+    return np.abs(np.sum(np.conj(quantum_data) * states, axis=1)) ** 2
+
+
+######################################################################
+# To make sure that nothing was lost along the way, we can run the full
+# QGRNN circuit, with its SWAP test, on a device with :math:`2n + 1` qubits
+# for some random parameters, and check that it gives the same fidelity:
+#
+
+qgrnn_dev = qml.device("default.qubit", wires=2 * qubit_number + 1)
+qnode = qml.QNode(qgrnn, qgrnn_dev)
+
+test_params = np.array([np.random.randint(-20, 20)/50 for i in range(0, 10)])
+assert np.allclose(
+    qnode(test_params[0:6], test_params[6:10], time=max_time),
+    qgrnn_fidelities(test_params[0:6], test_params[6:10], [max_time])[0],
+)
+
+
+######################################################################
+# We then define the negative fidelity cost function, averaging the
+# fidelities over :math:`N` randomly sampled times:
 #
 
 
@@ -595,18 +661,15 @@ def cost_function(params):
     # Randomly samples times at which the QGRNN runs
     times_sampled = [np.random.uniform() * max_time for i in range(0, N)]
 
-    # Cycles through each of the sampled times and calculates the cost
-    total_cost = 0
-    for i in times_sampled:
-        result = qnode(weight_params, bias_params, time=i)
-        total_cost += -1 * result
+    # Calculates the fidelities at the sampled times and the cost
+    total_cost = -1 * np.sum(qgrnn_fidelities(weight_params, bias_params, times_sampled))
 
     # Prints the value of the cost function
     if iterations % 5 == 0:
         print(
             "Fidelity at Step " + str(iterations) + ": " + str((-1 * total_cost / N)._value)
             )
-        print("Parameters at Step " + str(iterations) + ": " + str(params._value))
+        print("Parameters at Step " + str(iterations) + ": " + str(params._value.tolist()))
         print("---------------------------------------------")
 
     iterations += 1
@@ -615,23 +678,15 @@ def cost_function(params):
 
 
 ######################################################################
-# The last step is to define the new device and QNode, and execute the
-# optimizer. We use Adam,
-# with a step-size of :math:`0.5`:
+# Finally, we execute the optimizer.
+# We use Adam, with a step-size of :math:`0.5`:
 #
 
-# Defines the new device
-
-qgrnn_dev = qml.device("default.qubit", wires=2 * qubit_number + 1)
-
-# Defines the new QNode
-
-qnode = qml.QNode(qgrnn, qgrnn_dev)
-
 iterations = 0
 optimizer = qml.AdamOptimizer(stepsize=0.5)
+# sphinx_gallery_smoke = {"steps": 5}
 steps = 300
-qgrnn_params = list([np.random.randint(-20, 20)/50 for i in range(0, 10)])
+qgrnn_params = np.array([np.random.randint(-20, 20)/50 for i in range(0, 10)])
 init = copy.copy(qgrnn_params)
 
 # Executes the optimization method
@@ -1565,13 +1620,13 @@ init_ham = create_hamiltonian_matrix(
 
 fig, axes = plt.subplots(nrows=1, ncols=3, figsize=(6, 6))
 
-axes[0].matshow(ham_matrix, vmin=-7, vmax=7, cmap='hot')
+axes[0].matshow(ham_matrix.toarray(), vmin=-7, vmax=7, cmap='hot')
 axes[0].set_title("Target Hamiltonian", y=1.13)
 
-axes[1].matshow(init_ham, vmin=-7, vmax=7, cmap='hot')
+axes[1].matshow(init_ham.toarray(), vmin=-7, vmax=7, cmap='hot')
 axes[1].set_title("Initial Guessed Hamiltonian", y=1.13)
 
-axes[2].matshow(new_ham_matrix, vmin=-7, vmax=7, cmap='hot')
+axes[2].matshow(new_ham_matrix.toarray(), vmin=-7, vmax=7, cmap='hot')
 axes[2].set_title("Learned Hamiltonian", y=1.13)
 
 plt.subplots_adjust(wspace=0.3, hspace=0.3)
@@ -122,6 +122,7 @@ qb2wire = {i: j for i, j in zip(qubits, range(wires))}
 # change this (depending on your own computational restrictions).
 #
 
+# sphinx_gallery_smoke = {"shots": 1000, "num_of_evaluations": 2}
 shots = 500000
 dev = qml.device('cirq.qsim', wires=wires, qubits=qubits, shots=shots)
 
@@ -265,11 +266,16 @@ gate_sequence = np.resize(["A", "B", "C", "D"], m)
 # gates should be applied. We can use this list within the
 # circuit to know which gate to apply when.
 #
+# The list is generated from a random seed, so that each seed corresponds to
+# one circuit instance.
+#
+
+def generate_single_qubit_gate_list(seed):
+    rng = np.random.RandomState(seed)
 
-def generate_single_qubit_gate_list():
     # create the first list by randomly selecting indices
     # from single_qubit_gates
-    g = [list(np.random.choice(range(len(single_qubit_gates)), size=wires))]
+    g = [list(rng.choice(range(len(single_qubit_gates)), size=wires))]
 
     for cycle in range(len(gate_sequence)):
         g.append([])
@@ -281,7 +287,7 @@ def generate_single_qubit_gate_list():
             # and remove it from the choices of gates to be applied
             pop_idx = np.where(bool_list)[0][0]
             one_gate_removed.pop(pop_idx)
-            g[cycle + 1].append(np.random.choice(one_gate_removed))
+            g[cycle + 1].append(rng.choice(one_gate_removed))
     return g
 
 
@@ -293,17 +299,13 @@ def generate_single_qubit_gate_list():
 # single-qubit gates.
 #
 # From the QNode, we need both the probabilities of the measurement
-# results, as well as raw samples. To facilitate this, we add a keyword
-# argument to our circuit allowing us to switch between the two returns. We
-# sample from the Pauli-Z observable on all wires, which will give us the
-# eigenvalues :math:`\pm 1` of the observable, corresponding to the states
-# :math:`\left|0\right>` and :math:`\left|1\right>`.
+# results, as well as raw samples. The QNode returns the probabilities of all
+# the computational basis states.
 #
 
 @qml.qnode(dev)
-def circuit(seed=42, return_probs=False):
-    np.random.seed(seed)
-    gate_idx = generate_single_qubit_gate_list()
+def circuit(seed=42):
+    gate_idx = generate_single_qubit_gate_list(seed)
 
     # m full cycles - single-qubit gates & two-qubit gate
     for i, gs in enumerate(gate_sequence):
@@ -318,10 +320,22 @@ def circuit(seed=42, return_probs=False):
     for w in range(wires):
         single_qubit_gates[gate_idx[-1][w]](wires=w)
 
-    if return_probs:
-        return qml.probs(wires=range(wires))
-    else:
-        return [qml.sample(qml.PauliZ(i)) for i in range(wires)]
+    return qml.probs(wires=range(wires))
+
+
+######################################################################
+# Rather than simulating the same circuit a second time to sample from it,
+# we draw the samples directly from these probabilities using NumPy---which
+# is what the simulator does as well once it has computed the final state.
+# Each sampled bitstring is encoded as the integer that it represents in
+# binary, with the first wire being the most significant bit, i.e., as the
+# index of the corresponding basis state.
+#
+
+def probs_and_samples(seed):
+    probs = circuit(seed=seed)
+    samples = np.random.choice(len(probs), size=shots, p=probs / np.sum(probs))
+    return probs, samples
 
 
 ######################################################################
@@ -366,59 +380,39 @@ def circuit(seed=42, return_probs=False):
 #
 #    F_{XEB} = 2^{n}\left<P(x_i)\right> - 1 = \frac{2N}{N+1} - 1.
 #
-# We implement this fidelity as the function below, where ``samples`` is a
-# list of sampled bitstrings, and ``probs`` is a list with corresponding
-# sampling probabilities for the same noiseless circuit.
+# We implement this fidelity as the function below, where ``samples`` is an
+# array of sampled bitstrings, encoded as integers, and ``probs`` is an array
+# with the sampling probabilities of all the bitstrings for the same noiseless
+# circuit. Working with integers instead of strings lets NumPy look up the
+# probabilities of all the samples at once.
 #
 
 def fidelity_xeb(samples, probs):
-    sampled_probs = []
-    for bitstring in samples:
-        # convert each bitstring into an integer
-        bitstring_idx = int(bitstring, 2)
-
-        # retrieve the corresponding probability for the bitstring
-        sampled_probs.append(probs[bitstring_idx])
+    # retrieve the probabilities of the sampled bitstrings
+    sampled_probs = np.take(probs, samples)
 
-    return 2 ** len(samples[0]) * np.mean(sampled_probs) - 1
+    # 2^n is the number of possible bitstrings, i.e., the length of probs
+    return len(probs) * np.mean(sampled_probs) - 1
 
 
 ######################################################################
 # We set a random seed and use it to calculate the probability for all the
-# possible bitstrings. It is then possible to sample from exactly the same
-# circuit by using the same seed. Before calculating the cross-entropy
-# benchmarking fidelity, the Pauli-Z samples need to be converted into
-# their correponding bitstrings, since we need the samples to be in the
-# computational basis.
+# possible bitstrings, as well as samples from the same circuit.
 #
 
 seed = np.random.randint(0, 42424242)
-probs = circuit(seed=seed, return_probs=True)
-
-# transpose the samples to get the shape (shots, wires)
-circuit_samples = circuit(seed=seed).T
+probs, circuit_samples = probs_and_samples(seed)
 
-# take the eigenvalues and transform -1 to 1 and 1 to 0
-bitstring_samples = []
-for sam in circuit_samples:
-    bitstring_sample = -(sam - 1) // 2
-    bitstring_samples.append("".join(str(bs) for bs in bitstring_sample))
-
-f_circuit = fidelity_xeb(bitstring_samples, probs)
+f_circuit = fidelity_xeb(circuit_samples, probs)
 
 ######################################################################
 # Similarly, we can sample random bitstrings from a uniform probability
-# distribution by generating all basis states, along with their
-# corresponding bitstrings, and sample directly from them using NumPy.
+# distribution by sampling the integers they represent directly using NumPy.
 #
 
-basis_states = dev.generate_basis_states(wires)
-random_integers = np.random.randint(0, len(basis_states), size=shots)
-bitstring_samples = []
-for i in random_integers:
-    bitstring_samples.append("".join(str(bs) for bs in basis_states[i]))
+random_integers = np.random.randint(0, 2 ** wires, size=shots)
 
-f_uniform = fidelity_xeb(bitstring_samples, probs)
+f_uniform = fidelity_xeb(random_integers, probs)
 
 ######################################################################
 # Finally, let's compare the two different values. Sampling from the
@@ -478,22 +472,17 @@ theoretical_value = 2 * N / (N + 1) - 1
 
 print("Theoretical:", f"{theoretical_value:.7f}".rjust(24))
 
-f_circuit = []
+f_circuit = 0
 num_of_evaluations = 100
 for i in range(num_of_evaluations):
     seed = np.random.randint(0, 42424242)
 
-    probs = circuit(seed=seed, return_probs=True)
-    samples = circuit(seed=seed).T
-
-    bitstring_samples = []
-    for sam in samples:
-        new_sam = -(sam - 1) // 2
-        bitstring_samples.append("".join(str(bs) for bs in new_sam))
+    probs, samples = probs_and_samples(seed)
 
-    f_circuit.append(fidelity_xeb(bitstring_samples, probs))
-    print(f"\r{i + 1:4d} / {num_of_evaluations:4d}{' ':17}{np.mean(f_circuit):.7f}", end="")
-print("\rObserved:", f"{np.mean(f_circuit):.7f}".rjust(27))
+    # update the running mean of the fidelities
+    f_circuit += (fidelity_xeb(samples, probs) - f_circuit) / (i + 1)
+    print(f"\r{i + 1:4d} / {num_of_evaluations:4d}{' ':17}{f_circuit:.7f}", end="")
+print("\rObserved:", f"{f_circuit:.7f}".rjust(27))
 
 ##############################################################################
 # .. rst-class:: sphx-glr-script-out
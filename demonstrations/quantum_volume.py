@@ -329,7 +329,7 @@ import pennylane as qml
 # Object for random number generation from numpy
 rng = np.random.default_rng()
 
-def permute_qubits(num_qubits):
+def permute_qubits(num_qubits, rng):
     # A random permutation
     perm_order = list(rng.permutation(num_qubits))
 
@@ -377,8 +377,8 @@ def apply_random_su4_layer(num_qubits):
 #
 
 
-def qv_circuit_layer(num_qubits):
-    permute_qubits(num_qubits)
+def qv_circuit_layer(num_qubits, rng):
+    permute_qubits(num_qubits, rng)
     apply_random_su4_layer(num_qubits)
 
 
@@ -406,7 +406,7 @@ m = 3  # number of qubits
 with qml.tape.QuantumTape() as tape:
     for qubit in range(num_qubits):
         qml.RZ(0, wires=qubit)
-    qml.templates.layer(qv_circuit_layer, m, num_qubits=m)
+    qml.templates.layer(qv_circuit_layer, m, num_qubits=m, rng=rng)
 
 print(tape.draw())
 
@@ -476,26 +476,28 @@ print(tape.draw())
 # the classical simulation, or even consider new volume metrics [#cross]_.
 #
 # The heavy outputs can be retrieved from a classically-obtained probability
-# distribution as follows:
+# distribution as follows. Rather than storing them as a list of bit strings, we
+# represent the heavy outputs as a boolean mask over the integer outcomes
+# :math:`0, \ldots, 2^m - 1`, so that everything can be computed with a few
+# NumPy array operations:
 #
 
 def heavy_output_set(m, probs):
     # Compute heavy outputs of an m-qubit circuit with measurement outcome
     # probabilities given by probs, which is an array with the probabilities
-    # ordered as '000', '001', ... '111'.
+    # ordered as '000', '001', ... '111'. The probabilities of several circuits
+    # can also be given at once, as the rows of a 2-dimensional array.
 
-    # Sort the probabilities so that those above the median are in the second half
-    probs_ascending_order = np.argsort(probs)
-    sorted_probs = probs[probs_ascending_order]
+    # Partially sort the probabilities so that those above the median are in the
+    # second half; unlike a full sort, this takes linear time
+    probs_partial_order = np.argpartition(probs, 2 ** (m - 1), axis=-1)
 
     # Heavy outputs are the bit strings above the median
-    heavy_outputs = [
-        # Convert integer indices to m-bit binary strings
-        format(x, f"#0{m+2}b")[2:] for x in list(probs_ascending_order[2 ** (m - 1) :])
-    ]
+    heavy_outputs = np.zeros(probs.shape, dtype=bool)
+    np.put_along_axis(heavy_outputs, probs_partial_order[..., 2 ** (m - 1) :], True, axis=-1)
 
     # Probability of a heavy output
-    prob_heavy_output = np.sum(sorted_probs[2 ** (m - 1) :])
+    prob_heavy_output = np.sum(probs * heavy_outputs, axis=-1)
 
     return heavy_outputs, prob_heavy_output
 
@@ -521,7 +523,7 @@ for idx, prob in enumerate(output_probs):
 
 print(f"\nMedian is {np.median(output_probs):.4f}")
 print(f"Probability of a heavy output is {prob_heavy_output:.4f}")
-print(f"Heavy outputs are {heavy_outputs}")
+print(f"Heavy outputs are {[format(x, f'0{m}b') for x in np.flatnonzero(heavy_outputs)]}")
 
 
 ##############################################################################
@@ -543,7 +545,7 @@ print(f"Heavy outputs are {heavy_outputs}")
 #
 #     Median is 0.1454
 #     Probability of a heavy output is 0.7921
-#     Heavy outputs are ['010', '001', '111', '011']
+#     Heavy outputs are ['001', '010', '011', '111']
 
 ##############################################################################
 #
@@ -611,14 +613,14 @@ dev_noisy = qml.device(
 
 coupling_map = dev_ourense.backend.configuration().to_dict()["coupling_map"]
 
-dev_noisy.set_transpile_args(
-    **{
-        "optimization_level": 3,
-        "coupling_map": coupling_map,
-        "layout_method": "sabre",
-        "routing_method": "sabre",
-    }
-)
+transpile_args = {
+    "optimization_level": 3,
+    "coupling_map": coupling_map,
+    "layout_method": "sabre",
+    "routing_method": "sabre",
+}
+
+dev_noisy.set_transpile_args(**transpile_args)
 
 
 ##############################################################################
@@ -632,40 +634,97 @@ min_m = 2
 max_m = 5
 num_ms = (max_m - min_m) + 1
 
+# sphinx_gallery_smoke = {"num_trials": 2}
 num_trials = 200
 
-# To store the results
-probs_ideal = np.zeros((num_ms, num_trials))
-probs_noisy = np.zeros((num_ms, num_trials))
+##############################################################################
+#
+# All these trials are independent of each other, so we split them into chunks
+# of circuits of the same size that can be run in parallel. For each chunk, we
+# first generate all the circuits, and then execute them as a batch on each
+# device. With a finite number of shots, the probabilities returned by the noisy
+# device are the observed frequencies of the outcomes, so the fraction of heavy
+# outputs it produced is just the sum of these frequencies over the heavy outputs.
+#
+# Each chunk draws its random circuits, and seeds the transpiler and the noisy
+# simulator, from its own random number generator. These generators are all
+# derived from a single master seed, so the results are reproducible, and do not
+# depend on whether or how the chunks are run in parallel.
+#
+
+import multiprocessing
+import sys
+
+
+def qv_circuit_tape(m, rng):
+    # A random square circuit on m qubits, measuring the probabilities of its outcomes
+    with qml.tape.QuantumTape() as tape:
+        qml.templates.layer(qv_circuit_layer, m, num_qubits=m, rng=rng)
+        qml.probs(wires=range(m))
+    return tape
+
 
-for m in range(min_m, max_m + 1):
-    for trial in range(num_trials):
+def run_trials(m, num_circuits, seed):
+    # Heavy output probabilities of a chunk of random circuits on m qubits
+    rng = np.random.default_rng(seed)
 
-        # Simulate the circuit analytically
-        with qml.tape.QuantumTape() as tape:
-            qml.templates.layer(qv_circuit_layer, m, num_qubits=m)
-            qml.probs(wires=range(m))
+    # random_interferometer uses the global NumPy random number generator
+    np.random.seed(rng.integers(2 ** 32))
+    tapes = [qv_circuit_tape(m, rng) for trial in range(num_circuits)]
 
-        output_probs = tape.execute(dev_ideal).reshape(2 ** m, )
-        heavy_outputs, prob_heavy_output = heavy_output_set(m, output_probs)
+    # Simulate the circuits analytically
+    output_probs = np.reshape(dev_ideal.batch_execute(tapes), (num_circuits, 2 ** m))
+    heavy_outputs, prob_heavy_output = heavy_output_set(m, output_probs)
 
-        # Execute circuit on the noisy device
-        tape.execute(dev_noisy)
+    # Execute the circuits on the noisy device
+    dev_noisy.set_transpile_args(**transpile_args, seed_transpiler=int(rng.integers(2 ** 31)))
+    dev_noisy.run_args["seed_simulator"] = int(rng.integers(2 ** 31))
+    device_probs = np.reshape(dev_noisy.batch_execute(tapes), (num_circuits, 2 ** m))
+    fraction_device_heavy_output = np.sum(device_probs * heavy_outputs, axis=1)
 
-        # Get the output bit strings; flip ordering of qubits to match PennyLane
-        counts = dev_noisy._current_job.result().get_counts()
-        reordered_counts = {x[::-1]: counts[x] for x in counts.keys()}
+    return prob_heavy_output, fraction_device_heavy_output
 
-        device_heavy_outputs = np.sum(
-            [
-                reordered_counts[x] if x[:m] in heavy_outputs else 0
-                for x in reordered_counts.keys()
-            ]
-        )
-        fraction_device_heavy_output = device_heavy_outputs / dev_noisy.shots
 
-        probs_ideal[m - min_m, trial] = prob_heavy_output
-        probs_noisy[m - min_m, trial] = fraction_device_heavy_output
+chunk_size = 10
+chunks = [
+    (m, trials)
+    for m in range(min_m, max_m + 1)
+    for trials in np.array_split(np.arange(num_trials), int(np.ceil(num_trials / chunk_size)))
+]
+chunk_seeds = np.random.SeedSequence(42).spawn(len(chunks))
+tasks = [(m, len(trials), seed) for (m, trials), seed in zip(chunks, chunk_seeds)]
+
+##############################################################################
+#
+# The chunks are run in a pool of worker processes, forked from the current
+# one, so that each of them works with its own copy of the two devices. Forking
+# is not available on all platforms, and the workers need to find
+# ``run_trials`` in the main script, so the pool is only used when this demo is
+# run directly as a script. Processes that are themselves workers of a pool
+# (for instance, when building this website in parallel) cannot have child
+# processes either. Otherwise, the chunks are simply run one after the other.
+#
+
+use_pool = (
+    __name__ == "__main__"
+    and getattr(sys.modules["__main__"], "run_trials", None) is run_trials
+    and "fork" in multiprocessing.get_all_start_methods()
+    and not multiprocessing.current_process().daemon
+)
+
+if use_pool:
+    with multiprocessing.get_context("fork").Pool() as pool:
+        results = pool.starmap(run_trials, tasks)
+else:
+    results = [run_trials(*task) for task in tasks]
+
+# To store the results
+probs_ideal = np.zeros((num_ms, num_trials))
+probs_noisy = np.zeros((num_ms, num_trials))
+
+for (m, trials), (prob_heavy_output, fraction_device_heavy_output) in zip(chunks, results):
+    probs_ideal[m - min_m, trials] = prob_heavy_output
+    probs_noisy[m - min_m, trials] = fraction_device_heavy_output
 
 ##############################################################################
 #
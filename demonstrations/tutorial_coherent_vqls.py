@@ -214,6 +214,7 @@ m = 2                       # Number of ancillary qubits
 n_shots = 10 ** 6           # Number of quantum measurements
 tot_qubits = n_qubits + m   # System + ancillary qubits
 ancilla_idx = n_qubits      # Index of the first ancillary qubit
+# sphinx_gallery_smoke = {"steps": 2}
 steps = 10                  # Number of optimization steps
 eta = 0.8                   # Learning rate
 q_delta = 0.001             # Initial spread of random quantum weights
@@ -398,6 +399,39 @@ def cost(weights):
     return 1 - p_cond
 
 
+##############################################################################
+# The two QNodes above run exactly the same circuit, and only differ by their final
+# measurement. When using a simulator, we can instead simulate the circuit only once for
+# given weights, and compute both probabilities from the probabilities of all the
+# computational basis states, i.e., from the squared amplitudes of the final state vector.
+#
+# Using the ``default.qubit.autograd`` device, these probabilities can moreover be
+# differentiated by backpropagation through the simulation, rather than by simulating the
+# circuit again for each shifted parameter.
+
+dev_state = qml.device("default.qubit.autograd", wires=tot_qubits)
+
+@qml.qnode(dev_state, diff_method="backprop")
+def full_circuit_probs(weights):
+    # Circuit gates
+    full_circuit(weights)
+    # Probabilities of all the computational basis states
+    return qml.probs(wires=range(tot_qubits))
+
+
+def cost_state(weights):
+    """Cost function evaluated from a single simulation of the circuit."""
+
+    # The system qubits come first: reshape the probabilities as [system state, ancilla state]
+    probs = np.reshape(full_circuit_probs(weights), (2 ** n_qubits, 2 ** m))
+
+    p_global_ground = probs[0, 0]
+    p_ancilla_ground = np.sum(probs[:, 0])
+    p_cond = p_global_ground / p_ancilla_ground
+
+    return 1 - p_cond
+
+
 ##############################################################################
 # To minimize the cost function we use the gradient-descent optimizer.
 opt = qml.GradientDescentOptimizer(eta)
@@ -408,13 +442,15 @@ opt = qml.GradientDescentOptimizer(eta)
 np.random.seed(rng_seed)
 w = q_delta * np.random.randn(n_qubits)
 
+print("Cost = {:9.7f}".format(cost_state(w)))
+
 ##############################################################################
 # We are ready to perform the optimization loop.
 
 cost_history = []
 for it in range(steps):
-    w = opt.step(cost, w)
-    _cost = cost(w)
+    w = opt.step(cost_state, w)
+    _cost = cost_state(w)
     print("Step {:3d}       Cost = {:9.7f}".format(it, _cost))
     cost_history.append(_cost)
 
@@ -134,6 +134,7 @@ print(cost(init_params))
 opt = qml.GradientDescentOptimizer(stepsize=0.1)
 
 # set the number of steps
+# sphinx_gallery_smoke = {"steps": 2}
 steps = 20
 # set the initial parameter values
 params = init_params
@@ -279,6 +279,7 @@ plot_surface(local_surface)
 
 rotations = np.array([[3.] * len(range(wires)), [0.] * len(range(wires))])
 opt = qml.GradientDescentOptimizer(stepsize=0.2)
+# sphinx_gallery_smoke = {"steps": 2, "samples": 1}
 steps = 100
 params_global = rotations
 for i in range(steps):
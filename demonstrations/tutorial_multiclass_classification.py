@@ -63,6 +63,7 @@ train_split = 0.75
 # the number of the required qubits is calculated from the number of features
 num_qubits = int(np.ceil(np.log2(feature_size)))
 num_layers = 6
+# sphinx_gallery_smoke = {"total_iterations": 2}
 total_iterations = 100
 
 dev = qml.device("default.qubit", wires=num_qubits)
@@ -207,6 +208,114 @@ def accuracy(labels, hard_predictions):
     return loss
 
 
+#################################################################################
+# Batched Scores
+# ~~~~~~~~~~~~~~
+#
+# The loss and classification functions above run one circuit per class and per
+# sample, each with its own PyTorch graph, so most of the training time is spent in
+# the overhead of the QNodes rather than in the simulation of these small circuits.
+# Instead, we can simulate the circuits of all the classes for a whole batch of
+# feature vectors at once, using PyTorch operations with a leading class and batch
+# dimension. Since the states are complex, we keep track of their real and imaginary
+# parts separately. The ``Rot`` gates of all the classifiers are applied to each qubit
+# as a stack of :math:`2 \times 2` matrices, and the CNOT gates of a layer simply
+# permute the amplitudes of the computational basis states.
+
+
+def rot_matrices(W):
+    """Real and imaginary parts of the matrices of Rot gates with angles W[..., 0:3]."""
+    a = (W[..., 0] + W[..., 2]) / 2
+    b = (W[..., 0] - W[..., 2]) / 2
+    c = torch.cos(W[..., 1] / 2)
+    s = torch.sin(W[..., 1] / 2)
+    re = torch.stack(
+        [torch.cos(a) * c, -torch.cos(b) * s, torch.cos(b) * s, torch.cos(a) * c], -1
+    )
+    im = torch.stack(
+        [-torch.sin(a) * c, -torch.sin(b) * s, -torch.sin(b) * s, torch.sin(a) * c], -1
+    )
+    return re.reshape(W.shape[:-1] + (2, 2)), im.reshape(W.shape[:-1] + (2, 2))
+
+
+def apply_rot(re, im, W, wire):
+    """Applies one Rot gate per class to a qubit of the states of all classes and samples."""
+    shape = re.shape
+    re = re.reshape(shape[0], shape[1], 2 ** wire, 2, -1)
+    im = im.reshape(shape[0], shape[1], 2 ** wire, 2, -1)
+    g_re, g_im = rot_matrices(W)
+
+    def contract(g, x):
+        return torch.einsum("cij,cbajk->cbaik", g, x)
+
+    new_re = contract(g_re, re) - contract(g_im, im)
+    new_im = contract(g_re, im) + contract(g_im, re)
+    return new_re.reshape(shape), new_im.reshape(shape)
+
+
+def cnot_permutation():
+    """Indices of the amplitudes of the input state of a layer of CNOT gates that are
+    moved to each computational basis state."""
+    bits = (np.arange(2 ** num_qubits)[:, None] >> np.arange(num_qubits)[::-1]) & 1
+    for j in range(num_qubits - 1):
+        bits[:, j + 1] ^= bits[:, j]
+    if num_qubits >= 2:
+        bits[:, 0] ^= bits[:, num_qubits - 1]
+    targets = bits @ (2 ** np.arange(num_qubits)[::-1])
+    return torch.tensor(np.argsort(targets))
+
+
+cnot_layer = cnot_permutation()
+
+# Eigenvalues of the PauliZ measurement of qubit 0 for each computational basis state
+z0_eigvals = torch.tensor(1 - 2 * (np.arange(2 ** num_qubits) >> (num_qubits - 1)))
+
+
+def batched_scores(all_params, feature_vecs):
+    """Scores given by all the classifiers to a batch of feature vectors, as a tensor
+    of shape ``(batch, num_classes)``."""
+    weights = torch.stack(all_params[0]).double()
+    bias = torch.cat(all_params[1]).double()
+
+    # Amplitude embedding of the feature vectors, the same for all the classes
+    feats = torch.nn.functional.pad(feature_vecs.double(), (0, 2 ** num_qubits - feature_size))
+    feats = feats / torch.sqrt(torch.sum(feats ** 2, dim=1, keepdim=True))
+    re = feats.expand(num_classes, -1, -1)
+    im = torch.zeros_like(re)
+
+    for l in range(num_layers):
+        for i in range(num_qubits):
+            re, im = apply_rot(re, im, weights[:, l, i], i)
+        re, im = re[..., cnot_layer], im[..., cnot_layer]
+
+    expvals = (re ** 2 + im ** 2) @ z0_eigvals.double()
+    return (expvals + bias[:, None]).T.float()
+
+
+#################################################################################
+# With the scores of all the classes, the margin loss of all the samples of a
+# batch is computed at once, and the predicted class of each sample is the one
+# with the highest score.
+
+
+def batched_multiclass_svm_loss(all_params, feature_vecs, true_labels):
+    scores = batched_scores(all_params, feature_vecs)
+    labels = true_labels.long()
+    s_true = scores[torch.arange(len(labels)), labels]
+
+    # The score of the true class does not contribute to the loss
+    other_classes = torch.ones_like(scores)
+    other_classes[torch.arange(len(labels)), labels] = 0
+
+    margins = torch.clamp(scores - s_true[:, None] + margin, min=0) * other_classes
+    return torch.sum(margins) / len(labels)
+
+
+def batched_classify(all_params, feature_vecs):
+    with torch.no_grad():
+        return torch.argmax(batched_scores(all_params, feature_vecs), dim=1)
+
+
 #################################################################################
 # Data Loading and Processing
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -250,15 +359,14 @@ def split_data(feature_vecs, Y):
 # we wish to learn (variational circuit weights and classical bias). As these are
 # the variables we wish to optimize, we set the ``requires_grad`` flag to ``True``. We use
 # minibatch training---the average loss for a batch of samples is computed, and the
-# optimization step is based on this. Total training time with the default parameters
-# is roughly 15 minutes.
+# optimization step is based on this. The batched loss and classification functions
+# are used for the training.
 
 
 def training(features, Y):
     num_data = Y.shape[0]
     feat_vecs_train, feat_vecs_test, Y_train, Y_test = split_data(features, Y)
     num_train = Y_train.shape[0]
-    q_circuits = qnodes
 
     # Initialize the parameters
     all_weights = [
@@ -279,13 +387,13 @@ def training(features, Y):
         Y_train_batch = Y_train[batch_index]
 
         optimizer.zero_grad()
-        curr_cost = multiclass_svm_loss(q_circuits, params, feat_vecs_train_batch, Y_train_batch)
+        curr_cost = batched_multiclass_svm_loss(params, feat_vecs_train_batch, Y_train_batch)
         curr_cost.backward()
         optimizer.step()
 
         # Compute predictions on train and validation set
-        predictions_train = classify(q_circuits, params, feat_vecs_train, Y_train)
-        predictions_test = classify(q_circuits, params, feat_vecs_test, Y_test)
+        predictions_train = batched_classify(params, feat_vecs_train)
+        predictions_test = batched_classify(params, feat_vecs_test)
         acc_train = accuracy(Y_train, predictions_train)
         acc_test = accuracy(Y_test, predictions_test)
 
@@ -311,6 +311,7 @@ def noisy_cost(x):
 opt = qml.GradientDescentOptimizer(stepsize=0.4)
 
 # set the number of steps
+# sphinx_gallery_smoke = {"steps": 2}
 steps = 100
 # set the initial parameter values
 init_params = np.array([0.011, 0.012])
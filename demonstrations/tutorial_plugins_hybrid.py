@@ -218,6 +218,7 @@ print(dphoton_redirection([0.0, 0.0]))
 opt = qml.GradientDescentOptimizer(stepsize=0.4)
 
 # set the number of steps
+# sphinx_gallery_smoke = {"steps": 2}
 steps = 100
 # set the initial parameter values
 params = init_params
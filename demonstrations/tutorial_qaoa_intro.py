@@ -332,6 +332,7 @@ cost_function = qml.ExpvalCost(circuit, cost_h, dev)
 
 
 optimizer = qml.GradientDescentOptimizer()
+# sphinx_gallery_smoke = {"steps": 2}
 steps = 70
 params = [[0.5, 0.5], [0.5, 0.5]]
 
@@ -167,6 +167,7 @@ data_loader = torch.utils.data.DataLoader(
     list(zip(X, y_hot)), batch_size=5, shuffle=True, drop_last=True
 )
 
+# sphinx_gallery_smoke = {"epochs": 1}
 epochs = 6
 
 for epoch in range(epochs):
@@ -433,6 +433,7 @@ print(circuit.metric_tensor([params], diag_approx=True))
 # of the QNG Optimizer and the :class:`~.pennylane.GradientDescentOptimizer` for the simple variational
 # circuit above.
 
+# sphinx_gallery_smoke = {"steps": 2}
 steps = 200
 init_params = np.array([0.432, -0.123, 0.543, 0.233])
 
@@ -78,8 +78,11 @@ General setup
 This Python code requires *PennyLane* with the *TensorFlow* interface and the plotting library *matplotlib*.
 """
 
+import hashlib
+import os
+
 import pennylane as qml
-from pennylane import numpy as np
+import numpy as np
 from pennylane.templates import RandomLayers
 import tensorflow as tf
 from tensorflow import keras
@@ -89,13 +92,13 @@ import matplotlib.pyplot as plt
 # Setting of the main hyper-parameters of the model
 # ^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
 
+# sphinx_gallery_smoke = {"n_epochs": 2, "n_train": 10, "n_test": 5}
 n_epochs = 30   # Number of optimization epochs
 n_layers = 1    # Number of random layers
 n_train = 50    # Size of the train dataset
 n_test = 30     # Size of the test dataset
 
 SAVE_PATH = "quanvolution/" # Data saving folder
-PREPROCESS = True           # If False, skip quantum processing and load data from SAVE_PATH
 np.random.seed(0)           # Seed for NumPy random number generator
 tf.random.set_seed(0)       # Seed for TensorFlow random number generator
 
@@ -196,6 +199,75 @@ def quanv(image):
     return out
 
 
+##############################################################################
+# Batched quantum convolution
+# ^^^^^^^^^^^^^^^^^^^^^^^^^^^
+#
+# The function ``quanv`` evaluates the quantum circuit :math:`196` times per image, which
+# quickly adds up for a full dataset. However, the random circuit is *fixed*: the parameters
+# ``rand_params`` are never trained. We can therefore compute its unitary matrix :math:`U`
+# once, from the states it produces when applied to each of the :math:`16` computational
+# basis states.
+
+
+@qml.qnode(dev)
+def random_circuit(basis_state=None):
+    # Preparation of a computational basis state
+    qml.BasisState(basis_state, wires=list(range(4)))
+
+    # The same random quantum circuit as above
+    RandomLayers(rand_params, wires=list(range(4)))
+    return [qml.expval(qml.PauliZ(j)) for j in range(4)]
+
+
+def random_circuit_unitary():
+    """Returns the matrix of the random circuit, computed column by column."""
+    columns = []
+    for k in range(16):
+        random_circuit(basis_state=np.array([(k >> (3 - j)) & 1 for j in range(4)]))
+        columns.append(dev.state)
+    return np.stack(columns, axis=1)
+
+
+U = random_circuit_unitary()
+
+# Since the input states are real, U is split into its real and imaginary parts
+U_real = np.concatenate([U.real.T, U.imag.T], axis=1)
+
+# Eigenvalue of each PauliZ measurement (columns) on each basis state (rows)
+z_eigvals = np.array([[1 - 2 * ((k >> (3 - j)) & 1) for j in range(4)] for k in range(16)])
+
+##############################################################################
+# The embedding layer prepares each qubit :math:`j` in the state
+# :math:`\cos(\pi\phi_j/2)|0\rangle + \sin(\pi\phi_j/2)|1\rangle`, so the input state of
+# the circuit is a tensor product that is straightforward to compute for all the
+# :math:`2 \times 2` squares of a batch of images at the same time. Applying :math:`U` and
+# computing the expectation values of the :math:`4` measurements are then just two matrix
+# products.
+
+
+def quanv_batch(images):
+    """Convolves a batch of images, evaluating the quantum circuit on all their
+    2x2 squares at once."""
+    n = len(images)
+
+    # Squares of each image, with their pixels in the same order as in quanv
+    phi = images[..., 0].reshape(n, 14, 2, 14, 2).transpose(0, 1, 3, 2, 4).reshape(n, 14, 14, 4)
+
+    # Single-qubit states produced by the embedding layer
+    qubits = np.stack([np.cos(np.pi * phi / 2), np.sin(np.pi * phi / 2)], axis=-1)
+
+    # Tensor product of the single-qubit states
+    state = qubits[..., 0, :]
+    for j in range(1, 4):
+        state = (state[..., :, None] * qubits[..., j, None, :]).reshape(n, 14, 14, -1)
+
+    # Random quantum circuit and expectation values
+    amplitudes = state @ U_real
+    probs = amplitudes[..., :16] ** 2 + amplitudes[..., 16:] ** 2
+    return probs @ z_eigvals
+
+
 ##############################################################################
 # Quantum pre-processing of the dataset
 # ^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
@@ -205,33 +277,74 @@ def quanv(image):
 # Later an entirely classical model will be directly trained and tested on the
 # pre-processed dataset, avoiding unnecessary repetitions of quantum computations.
 #
-# The pre-processed images will be saved in the folder ``SAVE_PATH``.
-# Once saved, they can be directly loaded by setting ``PREPROCESS = False``,
-# otherwise the quantum convolution is evaluated at each run of the code.
-
-if PREPROCESS == True:
-    q_train_images = []
-    print("Quantum pre-processing of train images:")
-    for idx, img in enumerate(train_images):
-        print("{}/{}        ".format(idx + 1, n_train), end="\r")
-        q_train_images.append(quanv(img))
-    q_train_images = np.asarray(q_train_images)
-
-    q_test_images = []
-    print("\nQuantum pre-processing of test images:")
-    for idx, img in enumerate(test_images):
-        print("{}/{}        ".format(idx + 1, n_test), end="\r")
-        q_test_images.append(quanv(img))
-    q_test_images = np.asarray(q_test_images)
-
-    # Save pre-processed images
-    np.save(SAVE_PATH + "q_train_images.npy", q_train_images)
-    np.save(SAVE_PATH + "q_test_images.npy", q_test_images)
-
-
-# Load pre-processed images
-q_train_images = np.load(SAVE_PATH + "q_train_images.npy")
-q_test_images = np.load(SAVE_PATH + "q_test_images.npy")
+# The images are processed in batches with ``quanv_batch``, and the results are written
+# directly to a memory-mapped ``.npy`` file in the folder ``SAVE_PATH``, so that even the full
+# MNIST dataset (:math:`70000` images) is pre-processed in seconds rather than hours,
+# without holding all the results in memory.
+#
+# The file is stored in a subfolder named after a hash of the unitary :math:`U`, which
+# changes with ``n_layers``, ``rand_params`` or the seed of the random circuit, and of the
+# input images. Running the code again with the same circuit and images loads the saved
+# results, while any change leads to a new file instead of stale results. The batches that
+# are already processed are recorded as well, so that an interrupted pre-processing
+# resumes where it stopped.
+
+
+def cache_key(images, batch_size):
+    """Returns a hash of the quantum circuit, its parameters and the input images."""
+    key = hashlib.sha256()
+    key.update(np.round(U, 10).tobytes())
+    key.update(z_eigvals.tobytes())
+    key.update(np.ascontiguousarray(images, dtype=np.float64).tobytes())
+    key.update(str(batch_size).encode())
+    return key.hexdigest()[:16]
+
+
+def preprocess(images, batch_size=1000):
+    """Applies the quantum convolution to all the images, reusing the results
+    already saved in SAVE_PATH."""
+    folder = os.path.join(SAVE_PATH, cache_key(images, batch_size))
+    path = os.path.join(folder, "q_images.npy")
+    done_path = os.path.join(folder, "done.npy")
+    n_batches = (len(images) + batch_size - 1) // batch_size
+
+    q_images = None
+    if os.path.exists(done_path) and os.path.exists(path):
+        try:
+            q_images = np.lib.format.open_memmap(path, mode="r+")
+            done = np.load(done_path)
+        except (ValueError, EOFError):
+            # The saved results are truncated or corrupted
+            q_images = None
+
+    if q_images is None or q_images.shape != (len(images), 14, 14, 4):
+        os.makedirs(folder, exist_ok=True)
+        q_images = np.lib.format.open_memmap(
+            path, mode="w+", dtype=np.float32, shape=(len(images), 14, 14, 4)
+        )
+        done = np.zeros(n_batches, dtype=bool)
+
+    todo = np.flatnonzero(~done)
+    for b in todo:
+        start, stop = b * batch_size, (b + 1) * batch_size
+        print("{}/{}        ".format(min(stop, len(images)), len(images)), end="\r")
+        q_images[start:stop] = quanv_batch(images[start:stop])
+        q_images.flush()
+
+        # Mark the batch as processed only once its results are on disk
+        done[b] = True
+        np.save(done_path + ".tmp.npy", done)
+        os.replace(done_path + ".tmp.npy", done_path)
+
+    print("{} of {} batches loaded from {}".format(n_batches - len(todo), n_batches, folder))
+    return np.load(path, mmap_mode="r")
+
+
+print("Quantum pre-processing of train images:")
+q_train_images = preprocess(train_images)
+
+print("Quantum pre-processing of test images:")
+q_test_images = preprocess(test_images)
 
 ##############################################################################
 # Let us visualize the effect of the quantum convolution
@@ -347,6 +347,7 @@ print(cost(init_params))
 opt = qml.GradientDescentOptimizer(stepsize=0.4)
 
 # set the number of steps
+# sphinx_gallery_smoke = {"steps": 2}
 steps = 100
 # set the initial parameter values
 params = init_params
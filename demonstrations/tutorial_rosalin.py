@@ -223,7 +223,10 @@ params = init_params
 cost_wrs = []
 shots_wrs = []
 
-for i in range(100):
+# sphinx_gallery_smoke = {"steps": 3, "rosalin_steps": 3}
+steps = 100
+
+for i in range(steps):
     params = opt.step(cost, params)
     cost_wrs.append(cost(params))
     shots_wrs.append(total_shots*i)
@@ -245,7 +248,7 @@ params = init_params
 cost_adam = []
 shots_adam = []
 
-for i in range(100):
+for i in range(steps):
     params = opt.step(cost, params)
     cost_adam.append(cost(params))
     shots_adam.append(total_shots*i)
@@ -556,8 +559,9 @@ params = init_params
 
 cost_rosalin = [cost_analytic(params)]
 shots_rosalin = [0]
+rosalin_steps = 60
 
-for i in range(60):
+for i in range(rosalin_steps):
     params = opt.step(params)
     cost_rosalin.append(cost_analytic(params))
     shots_rosalin.append(opt.shots_used)
@@ -584,7 +588,7 @@ cost = qml.dot(coeffs, qml.map(StronglyEntanglingLayers, obs, device=non_analyti
 cost_adam = [cost_analytic(params)]
 shots_adam = [0]
 
-for i in range(100):
+for i in range(steps):
     params = opt.step(cost, params)
     cost_adam.append(cost_analytic(params))
     shots_adam.append(adam_shots_per_step * (i + 1))
@@ -209,6 +209,7 @@ def rotosolve_cycle(cost, params):
 
 init_params = [0.3, 0.25]
 params_rsol = init_params.copy()
+# sphinx_gallery_smoke = {"n_steps": 2}
 n_steps = 30
 
 costs_rotosolve = []
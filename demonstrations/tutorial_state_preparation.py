@@ -157,6 +157,7 @@ def cost_fn(params):
 opt = torch.optim.Adam([params], lr=0.1)
 
 # number of steps in the optimization routine
+# sphinx_gallery_smoke = {"steps": 2}
 steps = 200
 
 # the final stage of optimization isn't always the best, so we keep track of
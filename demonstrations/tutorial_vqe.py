@@ -188,6 +188,7 @@ print(params)
 # tolerance (difference in cost function for subsequent optimization steps) of :math:`\sim 10^{
 # -6}`.
 
+# sphinx_gallery_smoke = {"max_iterations": 2}
 max_iterations = 200
 conv_tol = 1e-06
 
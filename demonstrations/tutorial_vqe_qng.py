@@ -81,6 +81,7 @@ init_params = np.array([3.97507603, 3.00854038])
 # tutorial, we aim to reach a convergence tolerance of around :math:`10^{-6}`.
 # We use a step size of 0.01.
 
+# sphinx_gallery_smoke = {"max_iterations": 2}
 max_iterations = 500
 conv_tol = 1e-06
 step_size = 0.01
@@ -285,6 +285,7 @@ print(params)
 # the total spin :math:`S` of the prepared state as it is optimized through
 # the iterative procedure.
 
+# sphinx_gallery_smoke = {"max_iterations": 2}
 max_iterations = 100
 conv_tol = 1e-06
 prev_energy = cost_fn(params)
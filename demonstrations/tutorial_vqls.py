@@ -199,6 +199,7 @@ n_qubits = 3  # Number of system qubits.
 n_shots = 10 ** 6  # Number of quantum measurements.
 tot_qubits = n_qubits + 1  # Addition of an ancillary qubit.
 ancilla_idx = n_qubits  # Index of the ancillary qubit (last position).
+# sphinx_gallery_smoke = {"steps": 2}
 steps = 30  # Number of optimization steps
 eta = 0.8  # Learning rate
 q_delta = 0.001  # Initial spread of random quantum weights
@@ -278,10 +279,15 @@ def variational_block(weights):
 # and will be used to estimate the coefficients :math:`\mu_{l,l',j}` defined in the introduction.
 # A graphical representation of this circuit is shown at the top of this tutorial.
 
+#
+# Since the first gates applied to the ancillary qubit commute with the variational
+# circuit acting on the other qubits, we group them with the rest of the Hadamard test
+# in a separate function. This will be useful later on.
+
 dev_mu = qml.device("default.qubit", wires=tot_qubits)
 
-@qml.qnode(dev_mu)
-def local_hadamard_test(weights, l=None, lp=None, j=None, part=None):
+def hadamard_test_block(l=None, lp=None, j=None, part=None):
+    """Gates of the Hadamard test, except for the variational circuit."""
 
     # First Hadamard gate applied to the ancillary qubit.
     qml.Hadamard(wires=ancilla_idx)
@@ -291,9 +297,6 @@ def local_hadamard_test(weights, l=None, lp=None, j=None, part=None):
     if part == "Im" or part == "im":
         qml.PhaseShift(-np.pi / 2, wires=ancilla_idx)
 
-    # Variational circuit generating a guess for the solution vector |x>
-    variational_block(weights)
-
     # Controlled application of the unitary component A_l of the problem matrix A.
     CA(l)
 
@@ -315,6 +318,16 @@ def local_hadamard_test(weights, l=None, lp=None, j=None, part=None):
     # Second Hadamard gate applied to the ancillary qubit.
     qml.Hadamard(wires=ancilla_idx)
 
+
+@qml.qnode(dev_mu)
+def local_hadamard_test(weights, l=None, lp=None, j=None, part=None):
+
+    # Variational circuit generating a guess for the solution vector |x>
+    variational_block(weights)
+
+    # Hadamard test acting on |x> and on the ancillary qubit
+    hadamard_test_block(l=l, lp=lp, j=j, part=part)
+
     # Expectation value of Z for the ancillary qubit.
     return qml.expval(qml.PauliZ(wires=ancilla_idx))
 
@@ -373,6 +386,149 @@ def cost_loc(weights):
     return 0.5 - 0.5 * mu_sum / (n_qubits * psi_norm(weights))
 
 
+##############################################################################
+# Batched evaluation of the Hadamard tests
+# ----------------------------------------
+#
+# Evaluating the cost function as above requires running
+# :math:`2 L^2 (n + 1)` Hadamard tests, where :math:`L` is the number of terms of
+# :math:`A`, and even more of them to compute its gradient. However, all these circuits
+# start with the same variational block :math:`V(w)`, and only differ by the gates
+# that follow it. When simulating them, we can therefore evaluate all of them in a
+# single batch.
+#
+# Let :math:`T` be the unitary applied by a Hadamard test after the variational block.
+# The outcome of the test is the expectation value of the observable
+# :math:`T^\dagger Z_a T`, where :math:`Z_a` is the Pauli :math:`Z` operator of the
+# ancillary qubit, in the state :math:`|0\rangle_a \otimes |x\rangle`. Restricting this
+# observable to the states where the ancillary qubit is :math:`|0\rangle` gives an
+# observable acting on the system qubits only.
+#
+# Since :math:`T` does not depend on the weights, we compute its matrix once, column
+# by column, by applying the Hadamard test without the variational block to each
+# state of the computational basis.
+
+
+@qml.qnode(dev_mu)
+def hadamard_test_on_basis_state(basis_state, l=None, lp=None, j=None, part=None):
+    qml.BasisState(basis_state, wires=range(tot_qubits))
+    hadamard_test_block(l=l, lp=lp, j=j, part=part)
+    return qml.expval(qml.PauliZ(wires=ancilla_idx))
+
+
+def hadamard_test_observable(l, lp, j, part):
+    """Observable of the system qubits measured by a Hadamard test."""
+    columns = []
+    for k in range(2 ** tot_qubits):
+        basis_state = np.array([(k >> (tot_qubits - 1 - q)) & 1 for q in range(tot_qubits)])
+        hadamard_test_on_basis_state(basis_state, l=l, lp=lp, j=j, part=part)
+        columns.append(dev_mu.state)
+    T = np.stack(columns, axis=1)
+
+    # Pauli Z of the ancillary qubit, which is the last (least significant) one
+    Z_a = np.diag([1, -1] * 2 ** n_qubits)
+    observable = T.conj().T @ Z_a @ T
+
+    # Restriction to the states where the ancillary qubit is |0>
+    return observable[::2, ::2]
+
+
+##############################################################################
+# The sums over :math:`l, l'` and :math:`j` in the cost function are linear, so all the
+# coefficients :math:`\mu_{l,l',j}` they involve can be combined into a single observable.
+# Moreover, since :math:`\mu_{l',l,j} = \mu_{l,l',j}^*`, the terms :math:`(l, l')` and
+# :math:`(l', l)` of the sums are complex conjugates of each other, and only the Hadamard
+# tests with :math:`l \leq l'` need to be considered. This also shows that the sums are
+# real: their imaginary parts cancel out.
+
+
+def mu_sum_observable(j_values):
+    """Observable whose expectation value in the state |x> is the sum of the coefficients
+    c_l c_lp^* mu_{l,lp,j} over all l, lp and the given values of j."""
+    observable = 0
+
+    for l in range(0, len(c)):
+        for lp in range(l, len(c)):
+            for j in j_values:
+                mu_observable = hadamard_test_observable(l, lp, j, "Re") + (
+                    1.0j * hadamard_test_observable(l, lp, j, "Im")
+                )
+                term = c[l] * np.conj(c[lp]) * mu_observable
+
+                # Add the (lp, l) term, which is the adjoint of the (l, lp) one
+                if l == lp:
+                    observable = observable + (term + term.conj().T) / 2
+                else:
+                    observable = observable + term + term.conj().T
+
+    return observable
+
+
+mu_sum_obs = mu_sum_observable(range(0, n_qubits))
+psi_norm_obs = mu_sum_observable([-1])
+
+##############################################################################
+# Evaluating the cost function now only requires measuring these two observables
+# in the state :math:`|x\rangle`, which is prepared by the variational block alone.
+
+dev_x_exact = qml.device("default.qubit", wires=n_qubits)
+
+@qml.qnode(dev_x_exact)
+def batched_hadamard_tests(weights, observable=None):
+    variational_block(weights)
+    return qml.expval(qml.Hermitian(observable, wires=range(n_qubits)))
+
+
+def cost_loc_batched(weights):
+    """Local cost function C_L, evaluated with batched Hadamard tests."""
+    mu_sum = abs(batched_hadamard_tests(weights, observable=mu_sum_obs))
+    norm = abs(batched_hadamard_tests(weights, observable=psi_norm_obs))
+
+    # Cost function C_L
+    return 0.5 - 0.5 * mu_sum / (n_qubits * norm)
+
+
+##############################################################################
+# Both observables are measured in the same state :math:`|x\rangle`, yet the function
+# above simulates the variational block twice, and many more times to compute
+# gradients with the parameter-shift rule. When using a simulator, we can instead
+# simulate the variational block only once for given weights, and compute the
+# expectation values of the two observables directly from its state vector.
+#
+# The ``default.qubit.autograd`` device stores its state vector as an Autograd array,
+# so that quantities computed from this state can be differentiated by backpropagation.
+# Its QNodes must still return a measurement, even though we only need the state: the
+# state is read from the device after executing the circuit.
+
+dev_x_state = qml.device("default.qubit.autograd", wires=n_qubits)
+
+@qml.qnode(dev_x_state, diff_method="backprop")
+def variational_circuit(weights):
+    variational_block(weights)
+    return qml.probs(wires=range(n_qubits))
+
+
+def variational_state(weights):
+    """State vector |x> prepared by the variational block."""
+    variational_circuit(weights)
+    return dev_x_state.state
+
+
+def expval_in_state(observable, state):
+    """Expectation value of an observable in a state vector."""
+    return np.real(np.dot(np.conj(state), np.dot(observable, state)))
+
+
+def cost_loc_state(weights):
+    """Local cost function C_L, evaluated from the state vector |x>."""
+    x = variational_state(weights)
+    mu_sum = abs(expval_in_state(mu_sum_obs, x))
+    norm = abs(expval_in_state(psi_norm_obs, x))
+
+    # Cost function C_L
+    return 0.5 - 0.5 * mu_sum / (n_qubits * norm)
+
+
 ##############################################################################
 # Variational optimization
 # -----------------------------
@@ -382,6 +538,8 @@ def cost_loc(weights):
 np.random.seed(rng_seed)
 w = q_delta * np.random.randn(n_qubits)
 
+print("Cost_L = {:9.7f}".format(cost_loc_state(w)))
+
 ##############################################################################
 # To minimize the cost function we use the gradient-descent optimizer.
 opt = qml.GradientDescentOptimizer(eta)
@@ -392,8 +550,8 @@ opt = qml.GradientDescentOptimizer(eta)
 
 cost_history = []
 for it in range(steps):
-    w = opt.step(cost_loc, w)
-    cost = cost_loc(w)
+    w = opt.step(cost_loc_state, w)
+    cost = cost_loc_state(w)
     print("Step {:3d}       Cost_L = {:9.7f}".format(it, cost))
     cost_history.append(cost)
 
@@ -115,6 +115,7 @@ import scipy
 from scipy.optimize import minimize
 import networkx as nx
 import seaborn
+import functools
 import itertools
 
 ######################################################################
@@ -253,12 +254,8 @@ depth = 4
 dev = qml.device("default.qubit", wires=nr_qubits)
 
 
-def quantum_circuit(rotation_params, coupling_params, sample=None):
-
-    # Prepares the initial basis state corresponding to the sample
-    qml.templates.BasisStatePreparation(sample, wires=range(nr_qubits))
+def ansatz(rotation_params, coupling_params):
 
-    # Prepares the variational ansatz for the circuit
     for i in range(0, depth):
         single_rotation(rotation_params[i], range(nr_qubits))
         qml.broadcast(
@@ -268,6 +265,15 @@ def quantum_circuit(rotation_params, coupling_params, sample=None):
             parameters=coupling_params[i]
         )
 
+
+def quantum_circuit(rotation_params, coupling_params, sample=None):
+
+    # Prepares the initial basis state corresponding to the sample
+    qml.templates.BasisStatePreparation(sample, wires=range(nr_qubits))
+
+    # Prepares the variational ansatz for the circuit
+    ansatz(rotation_params, coupling_params)
+
     # Calculates the expectation value of the Hamiltonian with respect to the prepared states
     return qml.expval(qml.Hermitian(ham_matrix, wires=range(nr_qubits)))
 
@@ -399,6 +405,62 @@ def exact_cost(params):
     return final_cost
 
 
+######################################################################
+# This function runs the circuit :math:`2^n` times for every evaluation
+# of the cost, although only the initial basis state changes between the
+# runs. Since the ansatz is the same for all of them, we can instead
+# compute the matrix of :math:`U(\phi)` once, by applying its gates to
+# all the computational basis states at the same time. The columns of this
+# matrix are the states :math:`U(\phi)|x_i\rangle`, so all the energies
+# are given by the diagonal of :math:`U^{\dagger}(\phi) \hat{H} U(\phi)`.
+#
+
+
+def ansatz_unitary(rotation_params, coupling_params):
+
+    # Records the gates of the ansatz without executing them
+    with qml.tape.QuantumTape() as tape:
+        ansatz(rotation_params, coupling_params)
+
+    # The columns of the identity are the computational basis states; the
+    # first nr_qubits axes correspond to the qubits, and the last one to the states
+    states = np.eye(2 ** nr_qubits, dtype=complex).reshape([2] * nr_qubits + [-1])
+
+    for op in tape.operations:
+        wires = op.wires.tolist()
+        gate = np.reshape(op.matrix, [2] * (2 * len(wires)))
+        axes = list(range(len(wires), 2 * len(wires)))
+        states = np.tensordot(gate, states, axes=(axes, wires))
+        states = np.moveaxis(states, range(len(wires)), wires)
+
+    return states.reshape(2 ** nr_qubits, 2 ** nr_qubits)
+
+
+######################################################################
+# The probability of each basis state is the product of the probabilities
+# of the corresponding one-qubit states, so the diagonal of
+# :math:`\rho_\theta` is the Kronecker product of the rows of
+# ``prob_dist``, in the same order as the basis states. The cost is then
+# computed in a single pass:
+#
+
+
+def fast_cost(params):
+
+    # Transforms the parameter list
+    dist_params, ansatz_params = convert_list(params)
+    distribution = prob_dist(dist_params)
+
+    # Energies of all the transformed basis states
+    unitary = ansatz_unitary(ansatz_params[0], ansatz_params[1])
+    energies = np.real(np.sum(np.conj(unitary) * (ham_matrix @ unitary), axis=0))
+
+    # Diagonal of the initial density matrix
+    probabilities = functools.reduce(np.kron, distribution)
+
+    return beta * np.dot(probabilities, energies) - calculate_entropy(distribution)
+
+
 ######################################################################
 # We then create the function that is passed into the optimizer:
 #
@@ -408,7 +470,7 @@ def cost_execution(params):
 
     global iterations
 
-    cost = exact_cost(params)
+    cost = fast_cost(params)
 
     if iterations % 50 == 0:
         print("Cost at Step {}: {}".format(iterations, cost))
@@ -428,10 +490,12 @@ def cost_execution(params):
 
 
 iterations = 0
+# sphinx_gallery_smoke = {"max_iterations": 20}
+max_iterations = 1600
 
 number = nr_qubits * (1 + depth * 4)
 params = [np.random.randint(-300, 300) / 100 for i in range(0, number)]
-out = minimize(cost_execution, x0=params, method="COBYLA", options={"maxiter": 1600})
+out = minimize(cost_execution, x0=params, method="COBYLA", options={"maxiter": max_iterations})
 out_params = out["x"]
 
 
@@ -471,8 +535,40 @@ def prepare_state(params, device):
 
     return final_density_matrix
 
+
+######################################################################
+# As for the cost function, the circuit does not need to be executed once
+# for each basis state: the states :math:`U(\phi)|x_i\rangle` are the
+# columns of the matrix :math:`V` of the ansatz, so the density matrix is
+# the single product :math:`V \text{diag}(p) V^{\dagger}`, where
+# :math:`p` contains the probabilities of the basis states. For larger
+# numbers of qubits, the product can be computed a block of columns at a
+# time, directly into the final density matrix, to avoid allocating
+# additional matrices of the same size:
+#
+
+
+def prepare_state_batched(params, block_size=None):
+
+    dist_params, unitary_params = convert_list(params)
+    probabilities = functools.reduce(np.kron, prob_dist(dist_params))
+
+    states = ansatz_unitary(unitary_params[0], unitary_params[1])
+    weighted_states = states * probabilities
+
+    if block_size is None:
+        return weighted_states @ np.conj(states.T)
+
+    final_density_matrix = np.empty((2 ** nr_qubits, 2 ** nr_qubits), dtype=complex)
+    for start in range(0, 2 ** nr_qubits, block_size):
+        block = slice(start, start + block_size)
+        final_density_matrix[:, block] = weighted_states @ np.conj(states[block].T)
+
+    return final_density_matrix
+
+
 # Prepares the density matrix
-prep_density_matrix = prepare_state(out_params, dev)
+prep_density_matrix = prepare_state_batched(out_params)
 
 
 ######################################################################
@@ -0,0 +1,346 @@
+"""Persistent, content-addressed cache of executed gallery demos.
+
+Sphinx-gallery only skips a demo if the copy kept in the gallery directory is identical
+to its source, and knows nothing about the data files the demo loads or the versions of
+the packages it runs with. The :class:`ExecutionCache` instead keys every executed demo
+on a hash of
+
+* the source of the demo,
+* the data files it references (any string literal in the demo that is the path of an
+  existing file, such as ``"vqe_parallel/RY_params.npy"`` or ``"h2o.xyz"``), and
+* the pinned dependency set (``requirements.txt``) and any other file listed in
+  ``gallery_cache_dependencies``, where ``{name}`` is replaced by the name of the demo
+  (such as its recorded device snapshot),
+
+and stores everything sphinx-gallery generates for the demo: the rendered
+reStructuredText (including the captured output), the notebook, the figures and the
+thumbnail, together with its title and execution time. On a cache hit these are copied
+back into the gallery directory and reported to sphinx-gallery as if the demo had just
+been executed.
+
+Entries that have not been used for ``gallery_cache_max_age`` days are evicted, after
+which the least recently used entries are evicted until the cache is smaller than
+``gallery_cache_max_size`` megabytes.
+"""
+import ast
+import filecmp
+import glob
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import sphinx_gallery
+from sphinx_gallery.py_source_parser import split_code_and_text_blocks
+
+# incremented whenever the layout of the cache entries changes
+CACHE_VERSION = 1
+
+META_FILE = "meta.json"
+
+
+def file_hash(path):
+    """SHA-256 hex digest of the contents of a file."""
+    sha = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+def data_files(src_file):
+    """Data files referenced by a demo.
+
+    Every string literal in the demo that is the path of an existing file, relative
+    to the directory of the demo, is considered a dependency of the demo.
+
+    Args:
+        src_file (str): path of the demo script
+
+    Returns:
+        list[str]: sorted paths of the referenced files, relative to the demo directory
+    """
+    src_dir = os.path.dirname(src_file)
+
+    with open(src_file, "rb") as f:
+        tree = ast.parse(f.read(), filename=src_file)
+
+    files = set()
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Str) and node.s and "\n" not in node.s:
+            path = os.path.normpath(os.path.join(src_dir, node.s))
+
+            if os.path.isfile(path) and path != os.path.normpath(src_file):
+                files.add(os.path.relpath(path, src_dir))
+
+    return sorted(files)
+
+
+def source_key(src_file, dependencies=(), salt="", code_only=False):
+    """Hash of a demo and everything its execution depends on.
+
+    Args:
+        src_file (str): path of the demo script
+        dependencies (Sequence[str]): files that pin the dependencies of the demos, where
+            ``{name}`` is replaced by the name of the demo
+        salt (str): additional string identifying the execution settings
+        code_only (bool): if ``True``, only the code blocks of the demo are hashed, so
+            that the key does not change when only its prose is edited
+
+    Returns:
+        str: the SHA-256 hex digest identifying the demo and its dependencies
+    """
+    src_dir = os.path.dirname(src_file)
+    sha = hashlib.sha256()
+    sha.update(
+        "cache-{}|sphinx-gallery-{}|{}".format(
+            CACHE_VERSION, sphinx_gallery.__version__, salt
+        ).encode()
+    )
+
+    if code_only:
+        _, script_blocks = split_code_and_text_blocks(src_file)
+
+        for label, content, _ in script_blocks:
+            if label == "code":
+                sha.update(hashlib.sha256(content.encode()).hexdigest().encode())
+    else:
+        sha.update(file_hash(src_file).encode())
+
+    for fname in data_files(src_file):
+        sha.update(fname.encode())
+        sha.update(file_hash(os.path.join(src_dir, fname)).encode())
+
+    name = os.path.splitext(os.path.basename(src_file))[0]
+
+    for path in dependencies:
+        path = path.replace("{name}", name)
+
+        if os.path.isfile(path):
+            sha.update(file_hash(path).encode())
+
+    return sha.hexdigest()
+
+
+def example_artifacts(fname, target_dir):
+    """Files generated by sphinx-gallery for a demo.
+
+    Args:
+        fname (str): file name of the demo
+        target_dir (str): absolute path of the directory the gallery is written to
+
+    Returns:
+        list[str]: paths of the generated files, relative to ``target_dir``
+    """
+    name = os.path.splitext(fname)[0]
+    patterns = [
+        fname,
+        fname + ".md5",
+        name + ".rst",
+        name + ".ipynb",
+        name + "_codeobj.pickle",
+        name + "_outputs.json",
+        os.path.join("images", "sphx_glr_%s_[0-9][0-9][0-9].*" % name),
+        os.path.join("images", "thumb", "sphx_glr_%s_thumb.*" % name),
+    ]
+
+    artifacts = []
+
+    for pattern in patterns:
+        paths = glob.glob(os.path.join(glob.escape(target_dir), pattern))
+        artifacts.extend(sorted(os.path.relpath(path, target_dir) for path in paths))
+
+    return artifacts
+
+
+def copy_if_changed(src, dst):
+    """Copy a file, leaving the destination untouched if its contents are already identical.
+
+    This preserves the modification time of unchanged files, so that Sphinx does not
+    read the corresponding documents again.
+    """
+    if os.path.isfile(dst) and filecmp.cmp(src, dst, shallow=False):
+        return
+
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    shutil.copyfile(src, dst)
+
+
+class ExecutionCache:
+    """On-disk cache of executed demos.
+
+    Args:
+        path (str): directory containing the cache
+        dependencies (Sequence[str]): files that pin the dependencies of the demos, where
+            ``{name}`` is replaced by the name of the demo
+        max_size (float): maximum size of the cache in megabytes
+        max_age (float): maximum number of days an entry is kept without being used
+    """
+
+    def __init__(self, path, dependencies=(), max_size=2048, max_age=30):
+        self.path = path
+        self.dependencies = list(dependencies)
+        self.max_size = max_size
+        self.max_age = max_age
+
+    def key(self, src_file, salt=""):
+        """Key of the cache entry for a demo.
+
+        Args:
+            src_file (str): path of the demo script
+            salt (str): additional string identifying the execution settings
+
+        Returns:
+            str: the SHA-256 hex digest identifying the demo and its dependencies
+        """
+        return source_key(src_file, self.dependencies, salt)
+
+    def entry(self, key):
+        """Directory of the cache entry with the given key."""
+        return os.path.join(self.path, key[:2], key)
+
+    def load(self, key, fname, target_dir):
+        """Restore the outputs of a demo from the cache.
+
+        Args:
+            key (str): key of the cache entry
+            fname (str): file name of the demo
+            target_dir (str): absolute path of the directory the gallery is written to
+
+        Returns:
+            dict or None: the title, introduction and ``(time, memory)`` cost of the
+            demo, or ``None`` if the demo is not in the cache
+        """
+        entry = self.entry(key)
+        meta_file = os.path.join(entry, META_FILE)
+
+        if not os.path.isfile(meta_file):
+            return None
+
+        with open(meta_file, "r") as f:
+            meta = json.load(f)
+
+        for artifact in meta["artifacts"]:
+            copy_if_changed(
+                os.path.join(entry, "files", artifact), os.path.join(target_dir, artifact)
+            )
+
+        # the modification time of the metadata records when the entry was last used
+        os.utime(meta_file)
+
+        return {
+            "fname": fname,
+            "intro": meta["intro"],
+            "title": meta["title"],
+            "cost": tuple(meta["cost"]),
+            "traceback": None,
+        }
+
+    def store(self, key, result, target_dir):
+        """Store the outputs of a successfully executed demo in the cache.
+
+        Args:
+            key (str): key of the cache entry
+            result (dict): the title, introduction and ``(time, memory)`` cost of the demo
+            target_dir (str): absolute path of the directory the gallery is written to
+        """
+        entry = self.entry(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+
+        artifacts = example_artifacts(result["fname"], target_dir)
+        meta = {
+            "fname": result["fname"],
+            "intro": result["intro"],
+            "title": result["title"],
+            "cost": list(result["cost"]),
+            "artifacts": artifacts,
+            "created": time.time(),
+        }
+
+        # entries are written to a temporary directory first, so that an interrupted
+        # build never leaves a partial entry behind
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(entry))
+
+        try:
+            for artifact in artifacts:
+                dst = os.path.join(tmp, "files", artifact)
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                shutil.copyfile(os.path.join(target_dir, artifact), dst)
+
+            with open(os.path.join(tmp, META_FILE), "w") as f:
+                json.dump(meta, f, indent=1)
+
+            if os.path.isdir(entry):
+                shutil.rmtree(entry)
+
+            os.rename(tmp, entry)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def entries(self):
+        """All cache entries, as ``(last_used, size_in_bytes, path)`` tuples."""
+        entries = []
+
+        for meta_file in glob.glob(os.path.join(glob.escape(self.path), "*", "*", META_FILE)):
+            entry = os.path.dirname(meta_file)
+            size = sum(
+                os.path.getsize(os.path.join(root, f))
+                for root, _, files in os.walk(entry)
+                for f in files
+            )
+            entries.append((os.path.getmtime(meta_file), size, entry))
+
+        return entries
+
+    def prune(self):
+        """Evict stale entries, and then the least recently used ones until the cache is
+        within its maximum size.
+
+        Returns:
+            int: the number of evicted entries
+        """
+        entries = sorted(self.entries())
+        oldest = time.time() - self.max_age * 86400
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+
+        for last_used, size, entry in entries:
+            if last_used >= oldest and total <= self.max_size * 1024 ** 2:
+                break
+
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            evicted += 1
+
+        return evicted
+
+
+def dependency_files(config, src_dir):
+    """Absolute paths of the files listed in ``gallery_cache_dependencies``."""
+    return [os.path.join(src_dir, path) for path in config.gallery_cache_dependencies]
+
+
+def from_config(config, src_dir):
+    """Execution cache described by the Sphinx configuration.
+
+    Args:
+        config (sphinx.config.Config): the Sphinx configuration
+        src_dir (str): the Sphinx source directory
+
+    Returns:
+        ExecutionCache or None: the cache, or ``None`` if ``gallery_cache_dir`` is empty
+    """
+    if not config.gallery_cache_dir:
+        return None
+
+    return ExecutionCache(
+        os.path.join(src_dir, config.gallery_cache_dir),
+        dependencies=dependency_files(config, src_dir),
+        max_size=config.gallery_cache_max_size,
+        max_age=config.gallery_cache_max_age,
+    )
@@ -0,0 +1,601 @@
+"""Sphinx extension that caches the executed gallery demos, and executes them in a pool of
+worker processes.
+
+By default, sphinx-gallery executes every demonstration that matches
+``sphinx_gallery_conf["filename_pattern"]`` one after the other, inside the Sphinx
+process itself. A full build therefore costs the sum of the runtimes of all the demos,
+and any global state a demo leaves behind (matplotlib settings, TensorFlow/Torch
+thread pools, the seeded NumPy random state) is inherited by the next one.
+
+When the ``gallery_jobs`` configuration value is larger than one (or ``0``, meaning one
+job per available core), the demos that need executing are first dispatched to a pool
+of worker processes. Every demo runs in a freshly started interpreter, which renders the
+reStructuredText, notebook, figures and thumbnails of the demo exactly like a serial
+build would. Sphinx-gallery then assembles the gallery as usual, and the execution
+results (timings, passing and failing demos) are handed back to it so that the
+computation time summary and the junit report are unchanged.
+
+If ``gallery_cache_dir`` is set, demos whose source, data files and dependencies are
+unchanged since they were last executed are restored from the execution cache instead
+(see :mod:`gallery_cache`), and newly executed demos are added to it. If
+``gallery_profile`` is enabled, executed demos are profiled (see :mod:`gallery_profiling`),
+and if ``gallery_smoke`` is enabled, they are executed with the reduced values of their
+expensive knobs (see :mod:`gallery_smoke`). If ``gallery_incremental`` is enabled, demos
+whose code is unchanged since they were last executed are rendered from their recorded
+outputs instead (see :mod:`gallery_incremental`). Demos with a recorded device snapshot
+are executed with their remote devices replayed from it (see :mod:`gallery_snapshots`).
+
+If ``gallery_preload`` lists the heavy frameworks used by the demos, the worker
+processes are forked from a warm interpreter that already imported them, instead of
+being started from scratch (see :mod:`gallery_warmup`).
+
+Usage:
+
+.. code-block:: console
+
+    make html-parallel
+
+or, to choose the number of worker processes explicitly,
+
+.. code-block:: console
+
+    make html SPHINXOPTS="-D gallery_jobs=8"
+"""
+import contextlib
+import multiprocessing
+import os
+import re
+
+from sphinx.util import logging
+from sphinx_gallery import gen_gallery, gen_rst
+from sphinx_gallery.utils import get_md5sum
+
+import gallery_cache
+import gallery_incremental
+import gallery_profiling
+import gallery_smoke
+import gallery_snapshots
+import gallery_warmup
+
+logger = logging.getLogger(__name__)
+
+# the sphinx-gallery implementations that are wrapped by this extension
+_generate_dir_rst = gen_rst.generate_dir_rst
+_generate_file_rst = gen_rst.generate_file_rst
+
+# gallery configuration entries that accumulate state over the course of a build;
+# these are never forwarded to the worker processes
+_BUILD_STATE_KEYS = ("failing_examples", "passing_examples", "stale_examples", "titles")
+
+# file recording whether the outputs of a gallery directory were generated in smoke mode
+MODE_FILE = ".gallery_mode"
+
+
+def num_jobs(jobs):
+    """Number of worker processes corresponding to the ``gallery_jobs`` configuration value.
+
+    Args:
+        jobs (int): requested number of worker processes, where ``0`` requests
+            one worker per core available to the build
+
+    Returns:
+        int: the number of worker processes to use
+    """
+    if jobs > 0:
+        return jobs
+
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def example_files(src_dir, gallery_conf):
+    """Demo scripts of an example directory, in the order sphinx-gallery lists them.
+
+    Args:
+        src_dir (str): absolute path of the directory containing the demos
+        gallery_conf (dict): the sphinx-gallery configuration
+
+    Returns:
+        list[str]: file names of the demos
+    """
+    listdir = [fname for fname in os.listdir(src_dir) if fname.endswith(".py")]
+    listdir = [
+        fname
+        for fname in listdir
+        if re.search(gallery_conf["ignore_pattern"], os.path.normpath(os.path.join(src_dir, fname)))
+        is None
+    ]
+    return sorted(listdir, key=gallery_conf["within_subsection_order"](src_dir))
+
+
+def is_current(src_file, target_file):
+    """Whether sphinx-gallery will skip ``src_file`` because its previous run is up to date.
+
+    Args:
+        src_file (str): path of the demo script
+        target_file (str): path of the copy of the script in the gallery directory
+
+    Returns:
+        bool: ``True`` if the recorded MD5 checksum of the executed copy matches the script
+    """
+    md5_file = target_file + ".md5"
+
+    if not os.path.exists(md5_file):
+        return False
+
+    with open(md5_file, "r") as f:
+        return f.read() == get_md5sum(src_file)
+
+
+def executable_examples(src_dir, gallery_conf):
+    """Demos of an example directory that match the sphinx-gallery ``filename_pattern``.
+
+    Args:
+        src_dir (str): absolute path of the directory containing the demos
+        gallery_conf (dict): the sphinx-gallery configuration
+
+    Returns:
+        list[str]: file names of the demos
+    """
+    return [
+        fname
+        for fname in example_files(src_dir, gallery_conf)
+        if gen_rst.executable_script(os.path.normpath(os.path.join(src_dir, fname)), gallery_conf)
+    ]
+
+
+def profile_top(config):
+    """Number of hot functions to record per demo, or ``0`` if profiling is disabled."""
+    return config.gallery_profile_top if config.gallery_profile else 0
+
+
+def snapshot_dir(config, src_dir):
+    """Absolute path of the directory containing the recorded device snapshots."""
+    return os.path.join(src_dir, config.gallery_snapshot_dir)
+
+
+def execution_mode(config):
+    """Name of the execution mode of the demos, ``"smoke"`` or ``"full"``."""
+    return "smoke" if config.gallery_smoke else "full"
+
+
+def worker_conf(gallery_conf):
+    """Picklable copy of the user-facing part of a sphinx-gallery configuration.
+
+    The worker processes complete this configuration again on their side, exactly like
+    sphinx-gallery does when the build starts.
+    """
+    conf = {
+        key: value
+        for key, value in gallery_conf.items()
+        if key in gen_gallery.DEFAULT_GALLERY_CONF and key not in _BUILD_STATE_KEYS
+    }
+    # Backreference files are shared between all demos, and are only written
+    # by sphinx-gallery in the main process.
+    conf["backreferences_dir"] = None
+    return {
+        "conf": conf,
+        "src_dir": gallery_conf["src_dir"],
+        "abort_on_example_error": gallery_conf["abort_on_example_error"],
+        "lang": gallery_conf["lang"],
+        "builder_name": gallery_conf["builder_name"],
+        "profile_top": profile_top(gallery_conf["app"].config),
+        "smoke": gallery_conf["app"].config.gallery_smoke,
+        "mode": execution_mode(gallery_conf["app"].config),
+        "dependencies": gallery_cache.dependency_files(
+            gallery_conf["app"].config, gallery_conf["src_dir"]
+        ),
+        "snapshot_dir": snapshot_dir(gallery_conf["app"].config, gallery_conf["src_dir"]),
+        "snapshots": gallery_conf["app"].config.gallery_snapshots,
+    }
+
+
+def execute_example(fname, src_dir, target_dir, conf):
+    """Execute a single demo and write its gallery outputs.
+
+    This is run inside a worker process.
+
+    Args:
+        fname (str): file name of the demo
+        src_dir (str): absolute path of the directory containing the demo
+        target_dir (str): absolute path of the directory the gallery is written to
+        conf (dict): the output of :func:`worker_conf`
+
+    Returns:
+        dict: the title, introduction and ``(time, memory)`` cost of the demo, the
+        traceback left by the demo if it failed, and its profile if profiling is enabled
+    """
+    # pylint: disable=protected-access
+    gallery_conf = gen_gallery._complete_gallery_conf(
+        conf["conf"],
+        conf["src_dir"],
+        True,
+        conf["abort_on_example_error"],
+        conf["lang"],
+        conf["builder_name"],
+    )
+    os.makedirs(target_dir, exist_ok=True)
+    profiles = {}
+
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(gallery_snapshots.snapshots(conf["snapshot_dir"], conf["snapshots"]))
+
+        if conf["profile_top"]:
+            profiles = stack.enter_context(gallery_profiling.profiling(conf["profile_top"]))
+
+        if conf["smoke"]:
+            stack.enter_context(gallery_smoke.smoke_mode())
+
+        stack.enter_context(
+            gallery_incremental.incremental(conf["dependencies"], conf["mode"], reuse=False)
+        )
+        intro, title, cost = _generate_file_rst(fname, target_dir, src_dir, gallery_conf)
+
+    src_file = os.path.normpath(os.path.join(src_dir, fname))
+    return {
+        "fname": fname,
+        "intro": intro,
+        "title": title,
+        "cost": cost,
+        "traceback": gallery_conf["failing_examples"].get(src_file),
+        "profile": profiles.get(src_file),
+        "import_times": gallery_warmup.import_times,
+    }
+
+
+def _execute_example(args):
+    return execute_example(*args)
+
+
+def pool_context(preload):
+    """Multiprocessing context of the worker processes.
+
+    Args:
+        preload (Sequence[str]): names of the modules to import in a warm interpreter the
+            worker processes are forked from; if empty, or if forking is not supported,
+            each worker process is started from scratch
+
+    Returns:
+        multiprocessing.context.BaseContext: the context
+    """
+    if not preload or "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+
+    # the forkserver inherits the environment, through which it receives the modules to import
+    os.environ[gallery_warmup.PRELOAD_ENV] = ",".join(preload)
+    ctx = multiprocessing.get_context("forkserver")
+    ctx.set_forkserver_preload(["gallery_warmup", __name__])
+    return ctx
+
+
+def log_import_times(import_times):
+    """Report the time taken to import each preloaded framework."""
+    for name, t in sorted(import_times.items(), key=lambda item: -(item[1] or 0)):
+        status = "not installed" if t is None else "%.2f sec" % t
+        logger.info("preloaded %s: %s", name, status)
+
+
+def execute_parallel(examples, src_dir, target_dir, gallery_conf, jobs):
+    """Execute demos in a pool of worker processes.
+
+    Each worker process executes a single demo before exiting, so that no state is
+    shared between the demos. Worker processes are either started from scratch, or
+    forked from a warm interpreter if ``gallery_preload`` is set.
+
+    Args:
+        examples (list[str]): file names of the demos to execute
+        src_dir (str): absolute path of the directory containing the demos
+        target_dir (str): absolute path of the directory the gallery is written to
+        gallery_conf (dict): the sphinx-gallery configuration
+        jobs (int): number of worker processes
+
+    Returns:
+        dict[str, dict]: the results of :func:`execute_example`, keyed by file name
+    """
+    results = {}
+
+    if not examples:
+        return results
+
+    jobs = min(jobs, len(examples))
+    conf = worker_conf(gallery_conf)
+    logger.info(
+        "executing %d demos of %s in %d worker processes...",
+        len(examples),
+        os.path.relpath(src_dir, gallery_conf["src_dir"]),
+        jobs,
+    )
+
+    ctx = pool_context(gallery_conf["app"].config.gallery_preload)
+    tasks = [(fname, src_dir, target_dir, conf) for fname in examples]
+
+    with ctx.Pool(jobs, maxtasksperchild=1) as pool:
+        for res in pool.imap_unordered(_execute_example, tasks):
+            if res["import_times"] and "import_times" not in gallery_conf:
+                gallery_conf["import_times"] = res["import_times"]
+                log_import_times(res["import_times"])
+
+            results[res["fname"]] = res
+            status = "failed" if res["traceback"] is not None else "%.2f sec" % res["cost"][0]
+            logger.info("[%d/%d] %s: %s", len(results), len(examples), res["fname"], status)
+
+    return results
+
+
+def _replay_file_rst(results, cache=None, keys=None):
+    """Version of sphinx-gallery's ``generate_file_rst`` that reports the results of
+    demos that were already executed by a worker process or restored from the cache,
+    and stores newly executed demos in the cache."""
+    keys = keys or {}
+
+    def generate_file_rst(fname, target_dir, src_dir, gallery_conf, seen_backrefs=None):
+        src_file = os.path.normpath(os.path.join(src_dir, fname))
+        target_file = os.path.join(target_dir, fname)
+
+        if fname not in results:
+            intro, title, cost = _generate_file_rst(
+                fname, target_dir, src_dir, gallery_conf, seen_backrefs
+            )
+            executed = (
+                src_file in gallery_conf["passing_examples"]
+                and target_file not in gallery_conf["stale_examples"]
+            )
+
+            if cache is not None and fname in keys and executed:
+                res = {"fname": fname, "intro": intro, "title": title, "cost": cost}
+                cache.store(keys[fname], res, target_dir)
+
+            return intro, title, cost
+
+        res = results[fname]
+
+        if res["traceback"] is not None:
+            # The worker has already written the rendered traceback; the demo has no
+            # up-to-date checksum, and sphinx-gallery must not execute it a second time.
+            gallery_conf["titles"][src_file] = res["title"]
+            gallery_conf["failing_examples"][src_file] = res["traceback"]
+            logger.warning("%s failed to execute correctly: %s", src_file, res["traceback"])
+            return res["intro"], res["title"], res["cost"]
+
+        intro, title, _ = _generate_file_rst(fname, target_dir, src_dir, gallery_conf, seen_backrefs)
+
+        # sphinx-gallery sees the demo as previously run, since its checksum is up to date
+        if target_file in gallery_conf["stale_examples"]:
+            gallery_conf["stale_examples"].remove(target_file)
+
+        gallery_conf["passing_examples"].append(src_file)
+
+        if cache is not None and fname in keys and not res.get("cached", False):
+            cache.store(keys[fname], res, target_dir)
+
+        return intro, title, res["cost"]
+
+    return generate_file_rst
+
+
+@contextlib.contextmanager
+def replaying(results, cache=None, keys=None):
+    """Context manager within which sphinx-gallery reuses the given execution results."""
+    gen_rst.generate_file_rst = _replay_file_rst(results, cache, keys)
+    try:
+        yield
+    finally:
+        gen_rst.generate_file_rst = _generate_file_rst
+
+
+def invalidate(fname, target_dir):
+    """Remove the sphinx-gallery checksum of a demo, so that it is executed again."""
+    md5_file = os.path.join(target_dir, fname) + ".md5"
+
+    if os.path.exists(md5_file):
+        os.remove(md5_file)
+
+
+def switch_mode(examples, target_dir, mode):
+    """Record the execution mode of a gallery directory, invalidating all its demos if
+    their outputs were generated in the other mode.
+
+    Args:
+        examples (list[str]): file names of the demos
+        target_dir (str): absolute path of the directory the gallery is written to
+        mode (str): the execution mode of this build
+    """
+    mode_file = os.path.join(target_dir, MODE_FILE)
+    previous = "full"
+
+    if os.path.exists(mode_file):
+        with open(mode_file, "r") as f:
+            previous = f.read().strip()
+
+    if previous == mode:
+        return
+
+    logger.info("switching the demos of %s to %s mode", target_dir, mode)
+
+    for fname in examples:
+        invalidate(fname, target_dir)
+
+    with open(mode_file, "w") as f:
+        f.write(mode)
+
+
+def restore_cached(examples, src_dir, target_dir, cache, salt=""):
+    """Restore the outputs of demos from the execution cache.
+
+    Demos that are not in the cache lose their sphinx-gallery checksum, so that they
+    are executed again even if only their data files or dependencies changed.
+
+    Args:
+        examples (list[str]): file names of the demos
+        src_dir (str): absolute path of the directory containing the demos
+        target_dir (str): absolute path of the directory the gallery is written to
+        cache (gallery_cache.ExecutionCache): the execution cache
+        salt (str): additional string identifying the execution settings
+
+    Returns:
+        tuple[dict[str, dict], dict[str, str]]: the restored results and the cache keys
+        of all the demos, both keyed by file name
+    """
+    results = {}
+    keys = {}
+
+    for fname in examples:
+        keys[fname] = cache.key(os.path.join(src_dir, fname), salt)
+        res = cache.load(keys[fname], fname, target_dir)
+
+        if res is None:
+            invalidate(fname, target_dir)
+            continue
+
+        res["cached"] = True
+        results[fname] = res
+
+    if results:
+        logger.info("restored %d demos from the execution cache", len(results))
+
+    return results, keys
+
+
+def generate_dir_rst(src_dir, target_dir, gallery_conf, seen_backrefs):
+    """Generate the gallery reStructuredText for an example directory.
+
+    Drop-in replacement for the sphinx-gallery function of the same name, which restores
+    unchanged demos from the execution cache and executes the remaining demos of the
+    directory in parallel before generating the gallery.
+    """
+    app = gallery_conf["app"]
+    jobs = num_jobs(app.config.gallery_jobs)
+    cache = gallery_cache.from_config(app.config, gallery_conf["src_dir"])
+    top = profile_top(app.config)
+    mode = execution_mode(app.config)
+    dependencies = gallery_cache.dependency_files(app.config, gallery_conf["src_dir"])
+    snapshot_conf = snapshot_dir(app.config, gallery_conf["src_dir"]), app.config.gallery_snapshots
+    # profiled builds and snapshot recordings execute every demo
+    force = top or app.config.gallery_snapshots == "record"
+    reuse = app.config.gallery_incremental and not force
+    results = {}
+    keys = {}
+
+    if gallery_conf["plot_gallery"]:
+        os.makedirs(target_dir, exist_ok=True)
+
+        with gallery_snapshots.snapshots(*snapshot_conf):
+            examples = executable_examples(src_dir, gallery_conf)
+
+        switch_mode(examples, target_dir, mode)
+
+        if force:
+            for fname in examples:
+                invalidate(fname, target_dir)
+
+            if cache is not None:
+                keys = {fname: cache.key(os.path.join(src_dir, fname), mode) for fname in examples}
+
+        elif cache is not None:
+            results, keys = restore_cached(examples, src_dir, target_dir, cache, mode)
+
+        if jobs > 1:
+            pending = []
+
+            for fname in examples:
+                src_file = os.path.join(src_dir, fname)
+                target_file = os.path.join(target_dir, fname)
+
+                if fname in results or is_current(src_file, target_file):
+                    continue
+
+                # demos with unchanged code are rendered from their recorded outputs
+                if reuse and gallery_incremental.is_reusable(
+                    src_file, target_file, dependencies, mode
+                ):
+                    continue
+
+                pending.append(fname)
+
+            results.update(execute_parallel(pending, src_dir, target_dir, gallery_conf, jobs))
+
+    profiles = {}
+
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(gallery_snapshots.snapshots(*snapshot_conf))
+
+        if top:
+            profiles = stack.enter_context(gallery_profiling.profiling(top))
+
+        if app.config.gallery_smoke:
+            stack.enter_context(gallery_smoke.smoke_mode())
+
+        stack.enter_context(gallery_incremental.incremental(dependencies, mode, reuse))
+        stack.enter_context(replaying(results, cache, keys))
+        out = _generate_dir_rst(src_dir, target_dir, gallery_conf, seen_backrefs)
+
+    write_profiles(app, results, profiles, src_dir, target_dir, gallery_conf)
+    return out
+
+
+def write_profiles(app, results, profiles, src_dir, target_dir, gallery_conf):
+    """Collect the profiles of the demos executed serially and by the worker processes,
+    and write the profiling report and gallery page."""
+    if not profile_top(app.config):
+        gallery_profiling.write_profile_page(None, target_dir, gallery_conf["src_dir"])
+        return
+
+    for fname, res in results.items():
+        if res.get("profile") is not None:
+            profiles[os.path.normpath(os.path.join(src_dir, fname))] = res["profile"]
+
+    # the profiles of all the example directories are accumulated over the build
+    all_profiles = gallery_conf.setdefault("profiles", {})
+    all_profiles.update(profiles)
+
+    report = os.path.normpath(os.path.join(app.outdir, app.config.gallery_profile_report))
+    gallery_profiling.write_report(
+        all_profiles, report, gallery_conf["src_dir"], gallery_conf.get("import_times")
+    )
+    gallery_profiling.write_profile_page(profiles, target_dir, gallery_conf["src_dir"])
+
+
+def add_profile_tag(app, config):
+    """Set the ``gallery_profile`` tag in profiled builds, so that links to the build
+    profile page can be restricted to them with the ``only`` directive."""
+    if config.gallery_profile:
+        app.tags.add("gallery_profile")
+
+
+def prune_cache(app, exception):
+    """Evict stale entries from the execution cache at the end of the build."""
+    cache = gallery_cache.from_config(app.config, app.srcdir)
+
+    if cache is None or exception is not None:
+        return
+
+    evicted = cache.prune()
+
+    if evicted:
+        logger.info("evicted %d entries from the execution cache", evicted)
+
+
+def setup(app):
+    """Register the extension with Sphinx."""
+    app.add_config_value("gallery_jobs", 1, "html")
+    app.add_config_value("gallery_preload", [], "html")
+    app.add_config_value("gallery_cache_dir", "", "html")
+    app.add_config_value("gallery_cache_dependencies", ["requirements.txt"], "html")
+    app.add_config_value("gallery_cache_max_size", 2048, "html")
+    app.add_config_value("gallery_cache_max_age", 30, "html")
+    app.add_config_value("gallery_profile", False, "html")
+    app.add_config_value("gallery_profile_top", 20, "html")
+    app.add_config_value(
+        "gallery_profile_report", "../test-results/sphinx-gallery/profile.json", "html"
+    )
+    app.add_config_value("gallery_smoke", False, "html")
+    app.add_config_value("gallery_incremental", False, "html")
+    app.add_config_value("gallery_snapshots", "replay", "html")
+    app.add_config_value("gallery_snapshot_dir", "demonstrations/snapshots", "html")
+    app.connect("config-inited", gallery_incremental.skip_unchanged_zipfiles)
+    app.connect("config-inited", add_profile_tag)
+    app.connect("build-finished", prune_cache)
+    gen_gallery.generate_dir_rst = generate_dir_rst
+    return {"parallel_read_safe": True, "parallel_write_safe": True}
@@ -0,0 +1,218 @@
+"""Incremental rebuilds of the gallery.
+
+Sphinx-gallery executes a demo again whenever its source changes, even if only the prose
+of the demo was edited, and rewrites the zip archives of the whole gallery on every
+build. To make small edits cheap, the outputs of every successfully executed demo are
+recorded next to its generated files (``<name>_outputs.json``), keyed on its code
+blocks, the data files it references, the pinned dependency set and the execution mode.
+
+When ``gallery_incremental`` is enabled, a demo whose key is unchanged since its outputs
+were recorded is not executed again: its reStructuredText and notebook are regenerated
+from the current source, using the recorded outputs and the figures left in the gallery
+directory by the previous run. The outputs are recorded per code block, so that adding or
+removing text blocks does not shift them onto the wrong blocks. The zip archives of the gallery are only rewritten if
+one of the files they contain changed since they were last written.
+
+Usage:
+
+.. code-block:: console
+
+    make html-incremental
+"""
+import contextlib
+import glob
+import json
+import os
+import zipfile
+
+from sphinx_gallery import downloads, gen_rst
+from sphinx_gallery.utils import get_md5sum
+
+import gallery_cache
+
+OUTPUTS_SUFFIX = "_outputs.json"
+
+
+def outputs_file(target_file):
+    """Path of the recorded outputs of a demo, given the path of its copy in the gallery."""
+    return os.path.splitext(target_file)[0] + OUTPUTS_SUFFIX
+
+
+def example_images(target_file):
+    """Figures generated by a demo, relative to the gallery directory."""
+    target_dir = os.path.dirname(target_file)
+    name = os.path.splitext(os.path.basename(target_file))[0]
+    pattern = os.path.join(
+        glob.escape(target_dir), "images", "sphx_glr_%s_[0-9][0-9][0-9].*" % name
+    )
+    return sorted(os.path.relpath(path, target_dir) for path in glob.glob(pattern))
+
+
+def code_outputs(script_blocks, output_blocks):
+    """Outputs of the code blocks of a demo, dropping the empty outputs of its text blocks."""
+    return [
+        output for (label, _, _), output in zip(script_blocks, output_blocks) if label == "code"
+    ]
+
+
+def expand_outputs(script_blocks, outputs):
+    """Outputs of all the blocks of a demo, given the outputs of its code blocks.
+
+    Returns:
+        list[str] or None: one output per block, or ``None`` if the number of code blocks
+        does not match the number of recorded outputs
+    """
+    if sum(label == "code" for label, _, _ in script_blocks) != len(outputs):
+        return None
+
+    outputs = iter(outputs)
+    return [next(outputs) if label == "code" else "" for label, _, _ in script_blocks]
+
+
+def save_outputs(target_file, key, outputs, time_elapsed, memory_delta):
+    """Record the outputs of a successfully executed demo.
+
+    Args:
+        target_file (str): path of the copy of the demo in the gallery directory
+        key (str): the key of the demo, see :func:`gallery_cache.source_key`
+        outputs (list[str]): the reStructuredText outputs of the code blocks, see
+            :func:`code_outputs`
+        time_elapsed (float): execution time of the demo
+        memory_delta (float): memory used by the demo
+    """
+    record = {
+        "key": key,
+        "code_outputs": outputs,
+        "time": time_elapsed,
+        "memory": memory_delta,
+        "images": example_images(target_file),
+    }
+
+    with open(outputs_file(target_file), "w") as f:
+        json.dump(record, f)
+
+
+def load_outputs(target_file, key):
+    """Recorded outputs of a demo.
+
+    Args:
+        target_file (str): path of the copy of the demo in the gallery directory
+        key (str): the current key of the demo
+
+    Returns:
+        dict or None: the recorded outputs, or ``None`` if there are none for this key
+        or if the figures they refer to no longer exist
+    """
+    path = outputs_file(target_file)
+
+    if not os.path.isfile(path):
+        return None
+
+    with open(path, "r") as f:
+        record = json.load(f)
+
+    # records written before the outputs were stored per code block have no "code_outputs"
+    if record["key"] != key or "code_outputs" not in record:
+        return None
+
+    target_dir = os.path.dirname(target_file)
+
+    if not all(os.path.isfile(os.path.join(target_dir, image)) for image in record["images"]):
+        return None
+
+    return record
+
+
+def is_reusable(src_file, target_file, dependencies=(), salt=""):
+    """Whether a demo can be rendered from its recorded outputs instead of being executed."""
+    key = gallery_cache.source_key(src_file, dependencies, salt, code_only=True)
+    return load_outputs(target_file, key) is not None
+
+
+def python_zip(file_list, gallery_path, extension=".py"):
+    """Version of sphinx-gallery's ``python_zip`` that leaves an existing archive untouched
+    if none of the files it contains changed since it was written."""
+    zipname = os.path.basename(os.path.normpath(gallery_path))
+    zipname += "_python" if extension == ".py" else "_jupyter"
+    zipname = os.path.join(gallery_path, zipname + ".zip")
+
+    if os.path.isfile(zipname):
+        members = [os.path.splitext(fname)[0] + extension for fname in file_list]
+        newest = max((os.path.getmtime(member) for member in members), default=0)
+
+        with zipfile.ZipFile(zipname) as zipf:
+            names = set(zipf.namelist())
+
+        arcnames = {
+            os.path.relpath(member, gallery_path).replace(os.sep, "/") for member in members
+        }
+
+        if names == arcnames and newest <= os.path.getmtime(zipname):
+            return zipname
+
+    return _python_zip(file_list, gallery_path, extension)
+
+
+_python_zip = downloads.python_zip
+
+
+def skip_unchanged_zipfiles(app, config):
+    """Only rewrite the gallery zip archives when their contents changed, if
+    ``gallery_incremental`` is enabled."""
+    if config.gallery_incremental:
+        downloads.python_zip = python_zip
+
+
+@contextlib.contextmanager
+def incremental(dependencies=(), salt="", reuse=True):
+    """Context manager within which the outputs of the demos executed by sphinx-gallery
+    are recorded and, if ``reuse`` is ``True``, demos with unchanged code are rendered from
+    their recorded outputs instead of being executed.
+
+    Args:
+        dependencies (Sequence[str]): files that pin the dependencies of all the demos
+        salt (str): additional string identifying the execution settings
+        reuse (bool): whether to reuse the recorded outputs
+    """
+    execute_script = gen_rst.execute_script
+
+    def incremental_execute_script(script_blocks, script_vars, gallery_conf):
+        if not script_vars["execute_script"]:
+            return execute_script(script_blocks, script_vars, gallery_conf)
+
+        src_file = script_vars["src_file"]
+        target_file = script_vars["target_file"]
+        key = gallery_cache.source_key(src_file, dependencies, salt, code_only=True)
+        record = load_outputs(target_file, key) if reuse else None
+        outputs = expand_outputs(script_blocks, record["code_outputs"]) if record else None
+
+        if outputs is not None:
+            # mirror the bookkeeping of a successful execution by sphinx-gallery
+            script_vars["example_globals"] = None
+            script_vars["memory_delta"] = record["memory"]
+
+            with open(target_file + ".md5", "w") as f:
+                f.write(get_md5sum(target_file))
+
+            gallery_conf["passing_examples"].append(src_file)
+            return outputs, record["time"]
+
+        output_blocks, time_elapsed = execute_script(script_blocks, script_vars, gallery_conf)
+
+        if script_vars["execute_script"]:
+            save_outputs(
+                target_file,
+                key,
+                code_outputs(script_blocks, output_blocks),
+                time_elapsed,
+                script_vars["memory_delta"],
+            )
+
+        return output_blocks, time_elapsed
+
+    gen_rst.execute_script = incremental_execute_script
+
+    try:
+        yield
+    finally:
+        gen_rst.execute_script = execute_script
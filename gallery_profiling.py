@@ -0,0 +1,343 @@
+"""Opt-in profiling of the gallery demos.
+
+When ``gallery_profile`` is enabled, the execution of every demo is measured, recording
+
+* the wall time and the CPU time of the demo,
+* the peak resident set size while executing it (on platforms where the peak cannot be
+  reset between demos, this is the peak of the whole process so far, and is marked as
+  such),
+* the number of executions performed by all PennyLane devices it created, and
+* the ``gallery_profile_top`` functions with the largest internal time, as reported
+  by :mod:`cProfile`.
+
+The results are written to a machine-readable JSON report at ``gallery_profile_report``
+(relative to the HTML output directory, like the sphinx-gallery junit report), and to
+the ``sg_build_profile`` page of the gallery, which is linked from the demonstrations
+index in profiled builds only (through the ``gallery_profile`` tag). Profiled builds execute every demo,
+bypassing the execution cache and the sphinx-gallery checksums, so that the report
+covers the whole gallery.
+
+Usage:
+
+.. code-block:: console
+
+    make html-profile
+"""
+import codecs
+import contextlib
+import cProfile
+import datetime
+import json
+import os
+import pstats
+import subprocess
+import sys
+import time
+
+from sphinx_gallery import gen_rst
+from sphinx_gallery.utils import _replace_md5
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+PROFILE_PAGE = "sg_build_profile.rst"
+
+PROFILE_HEADER = """
+:orphan:
+
+.. _sphx_glr_{0}_sg_build_profile:
+
+Build profile
+=============
+"""
+
+PROFILE_DISABLED = """
+Profiling was not enabled for this build. To profile the demos, build the website using
+
+.. code-block:: console
+
+    make html-profile
+"""
+
+
+def reset_peak_rss():
+    """Reset the peak resident set size of the current process.
+
+    This is only supported on Linux.
+
+    Returns:
+        bool: whether the peak was reset
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+
+    return True
+
+
+def peak_rss():
+    """Peak resident set size of the current process in megabytes, or ``None`` if unknown.
+
+    On Linux, this is the peak since the last call to :func:`reset_peak_rss`; elsewhere it
+    is the peak over the lifetime of the process.
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    if resource is None:
+        return None
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is reported in bytes on macOS, and in kilobytes elsewhere
+    if sys.platform == "darwin":
+        return maxrss / 1024 ** 2
+
+    return maxrss / 1024
+
+
+@contextlib.contextmanager
+def counting_device_executions():
+    """Context manager keeping track of all the PennyLane devices created within it.
+
+    Yields:
+        list[pennylane.Device]: the devices created so far
+    """
+    devices = []
+
+    try:
+        from pennylane import Device  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        yield devices
+        return
+
+    device_init = Device.__init__
+
+    def __init__(self, *args, **kwargs):
+        device_init(self, *args, **kwargs)
+        devices.append(self)
+
+    Device.__init__ = __init__
+
+    try:
+        yield devices
+    finally:
+        Device.__init__ = device_init
+
+
+def hot_functions(profiler, top):
+    """Functions with the largest internal time recorded by a profiler.
+
+    Args:
+        profiler (cProfile.Profile): the profiler
+        top (int): number of functions to return
+
+    Returns:
+        list[dict]: the location, number of calls, internal time and cumulative
+        time of the functions
+    """
+    stats = pstats.Stats(profiler)
+    rows = []
+
+    for (filename, lineno, name), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+        rows.append(
+            {
+                "function": "{}:{}({})".format(filename, lineno, name),
+                "ncalls": ncalls,
+                "tottime": tottime,
+                "cumtime": cumtime,
+            }
+        )
+
+    rows.sort(key=lambda row: row["tottime"], reverse=True)
+    return rows[:top]
+
+
+@contextlib.contextmanager
+def profiling(top):
+    """Context manager within which the demos executed by sphinx-gallery are profiled.
+
+    Args:
+        top (int): number of hot functions recorded per demo
+
+    Yields:
+        dict[str, dict]: the profiles of the executed demos, keyed by the path of the demo
+    """
+    profiles = {}
+    execute_script = gen_rst.execute_script
+
+    def profiled_execute_script(script_blocks, script_vars, gallery_conf):
+        if not script_vars["execute_script"]:
+            return execute_script(script_blocks, script_vars, gallery_conf)
+
+        profiler = cProfile.Profile()
+        rss_reset = reset_peak_rss()
+
+        with counting_device_executions() as devices:
+            wall_start = time.perf_counter()
+            cpu_start = time.process_time()
+            profiler.enable()
+
+            try:
+                res = execute_script(script_blocks, script_vars, gallery_conf)
+            finally:
+                profiler.disable()
+
+            profiles[script_vars["src_file"]] = {
+                "wall_time": time.perf_counter() - wall_start,
+                "cpu_time": time.process_time() - cpu_start,
+                "peak_rss": peak_rss(),
+                "peak_rss_scope": "demo" if rss_reset else "process",
+                "device_executions": sum(dev.num_executions for dev in devices),
+                "devices": sorted({dev.short_name for dev in devices}),
+                "hot_functions": hot_functions(profiler, top),
+            }
+
+        return res
+
+    gen_rst.execute_script = profiled_execute_script
+
+    try:
+        yield profiles
+    finally:
+        gen_rst.execute_script = execute_script
+
+
+def git_revision(src_dir):
+    """Git revision of the source directory, or ``None`` if it is not a git checkout."""
+    try:
+        out = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=src_dir, stderr=subprocess.DEVNULL
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return out.decode().strip()
+
+
+def write_report(profiles, path, src_dir, import_times=None):
+    """Write the JSON profiling report.
+
+    Args:
+        profiles (dict[str, dict]): the profiles of the executed demos, keyed by the
+            path of the demo
+        path (str): path of the report
+        src_dir (str): the Sphinx source directory
+        import_times (dict[str, float]): the time taken to import each framework
+            preloaded in the worker processes, if any
+    """
+    report = {
+        "revision": git_revision(src_dir),
+        "date": datetime.datetime.utcnow().isoformat(),
+        "demos": {os.path.relpath(k, src_dir): v for k, v in sorted(profiles.items())},
+    }
+
+    if import_times:
+        report["import_times"] = import_times
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, "w") as f:
+        json.dump(report, f, indent=1)
+
+
+def _format(value, fmt):
+    return "--" if value is None else fmt.format(value)
+
+
+def _table(rows):
+    """reStructuredText grid table from a list of rows, the first of which is the header."""
+    lens = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    hline = "".join("+" + "-" * (n + 2) for n in lens) + "+\n"
+    header_line = hline.replace("-", "=")
+    out = hline
+
+    for i, row in enumerate(rows):
+        out += "".join("| " + cell.ljust(n) + " " for cell, n in zip(row, lens)) + "|\n"
+        out += header_line if i == 0 else hline
+
+    return out
+
+
+def write_profile_page(profiles, target_dir, src_dir):
+    """Write the gallery page summarizing the profiles of the executed demos.
+
+    Args:
+        profiles (dict[str, dict]): the profiles of the executed demos, keyed by the
+            path of the demo, or ``None`` if profiling is disabled
+        target_dir (str): absolute path of the directory the gallery is written to
+        src_dir (str): the Sphinx source directory
+    """
+    ref = os.path.relpath(target_dir, src_dir).replace(os.path.sep, "_")
+    content = PROFILE_HEADER.format(ref)
+
+    if profiles is None:
+        content += PROFILE_DISABLED
+    elif not profiles:
+        content += "\nNo demos were executed during this build.\n"
+    else:
+        revision = git_revision(src_dir)
+        if revision is not None:
+            content += "\nProfile of the demos executed at revision ``{}``.\n\n".format(revision)
+
+        rows = [["Demo", "Wall time (s)", "CPU time (s)", "Peak RSS (MB)", "Device executions"]]
+        by_time = sorted(profiles.items(), key=lambda item: item[1]["wall_time"], reverse=True)
+
+        for src_file, profile in by_time:
+            name = os.path.splitext(os.path.basename(src_file))[0]
+            rows.append(
+                [
+                    ":doc:`{}`".format(name),
+                    "{:.2f}".format(profile["wall_time"]),
+                    "{:.2f}".format(profile["cpu_time"]),
+                    _format(
+                        profile["peak_rss"],
+                        "{:.0f}*" if profile["peak_rss_scope"] == "process" else "{:.0f}",
+                    ),
+                    str(profile["device_executions"]),
+                ]
+            )
+
+        content += "\n" + _table(rows) + "\n"
+
+        if any(profile["peak_rss_scope"] == "process" for profile in profiles.values()):
+            content += (
+                "\\* Peak resident set size of the whole process executing the demo so far, "
+                "as it could not be reset before the demo.\n\n"
+            )
+
+        for src_file, profile in by_time:
+            name = os.path.splitext(os.path.basename(src_file))[0]
+            heading = "Hot functions of ``{}``".format(name)
+            content += "\n{}\n{}\n\n".format(heading, "-" * len(heading))
+
+            rows = [["Function", "Calls", "Internal time (s)", "Cumulative time (s)"]]
+            for row in profile["hot_functions"]:
+                rows.append(
+                    [
+                        "``{}``".format(row["function"]),
+                        str(row["ncalls"]),
+                        "{:.3f}".format(row["tottime"]),
+                        "{:.3f}".format(row["cumtime"]),
+                    ]
+                )
+
+            content += _table(rows) + "\n"
+
+    os.makedirs(target_dir, exist_ok=True)
+    page_new = os.path.join(target_dir, PROFILE_PAGE + ".new")
+
+    with codecs.open(page_new, "w", encoding="utf-8") as f:
+        f.write(content)
+
+    # only replace the page if it changed, so that Sphinx does not read it again
+    _replace_md5(page_new)
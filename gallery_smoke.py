@@ -0,0 +1,95 @@
+"""Smoke mode for the gallery demos.
+
+Many demos run long optimization loops or sample a large number of circuits, which is
+needed for the published results but not to check that a demo still executes end to
+end. A demo declares its expensive knobs (optimization steps, trials, shots, dataset
+sizes, ...) together with the reduced values to use in smoke mode, using a
+sphinx-gallery configuration comment:
+
+.. code-block:: python
+
+    # sphinx_gallery_smoke = {"steps": 5, "num_trials": 2}
+    steps = 300
+    num_trials = 200
+
+When ``gallery_smoke`` is enabled, every top-level, single-line assignment to one of the
+declared names is replaced by an assignment of the reduced value before the code block
+is executed. The rendered code, the notebook and the downloadable script are unchanged,
+and the configuration comment itself is removed from the rendered pages by
+sphinx-gallery.
+
+Usage:
+
+.. code-block:: console
+
+    make html-smoke
+"""
+import contextlib
+import re
+
+from sphinx_gallery import gen_rst
+from sphinx_gallery.py_source_parser import extract_file_config
+
+
+def smoke_knobs(src_file):
+    """Expensive knobs declared by a demo.
+
+    Args:
+        src_file (str): path of the demo script
+
+    Returns:
+        dict[str, object]: the reduced value of each knob, keyed by variable name
+    """
+    with open(src_file, "r", encoding="utf-8") as f:
+        knobs = extract_file_config(f.read()).get("smoke", {})
+
+    if not isinstance(knobs, dict):
+        raise ValueError(
+            "sphinx_gallery_smoke in {} must be a dictionary, got {!r}".format(src_file, knobs)
+        )
+
+    return knobs
+
+
+def shrink(code, knobs):
+    """Replace the values assigned to expensive knobs in a code block.
+
+    Args:
+        code (str): the code block
+        knobs (dict[str, object]): the reduced value of each knob, keyed by variable name
+
+    Returns:
+        str: the code block with the top-level assignments of the knobs replaced
+    """
+    for name, value in knobs.items():
+        pattern = r"^({}\s*=(?!=)\s*).*$".format(re.escape(name))
+        code = re.sub(pattern, lambda m, v=value: m.group(1) + repr(v), code, flags=re.MULTILINE)
+
+    return code
+
+
+@contextlib.contextmanager
+def smoke_mode():
+    """Context manager within which the demos executed by sphinx-gallery use the reduced
+    values of their expensive knobs."""
+    execute_code_block = gen_rst.execute_code_block
+    knobs = {}
+
+    def smoke_execute_code_block(compiler, block, example_globals, script_vars, gallery_conf):
+        label, content, lineno = block
+        src_file = script_vars["src_file"]
+
+        if src_file not in knobs:
+            knobs[src_file] = smoke_knobs(src_file)
+
+        if label == "code" and knobs[src_file]:
+            block = (label, shrink(content, knobs[src_file]), lineno)
+
+        return execute_code_block(compiler, block, example_globals, script_vars, gallery_conf)
+
+    gen_rst.execute_code_block = smoke_execute_code_block
+
+    try:
+        yield
+    finally:
+        gen_rst.execute_code_block = execute_code_block
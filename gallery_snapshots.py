@@ -0,0 +1,319 @@
+"""Recorded device snapshots for demos that need quantum hardware or remote services.
+
+Some demos run on devices that are not available in an offline build, such as the Rigetti
+QPUs and QVM server (``forest.qpu``, ``forest.qvm``), IBM Q (``qiskit.ibmq``) or Amazon
+Braket managed simulators (``braket.aws.qubit``). Their results can be captured once,
+on a machine with access to these devices, into a snapshot file in
+``gallery_snapshot_dir``:
+
+.. code-block:: console
+
+    make record-snapshots DEMOS=pytorch_noise
+
+While recording, every remote device created by the demo executes as usual, and the
+metadata of the device (wires, shots, supported operations and observables, and
+capabilities) and the result of every circuit it executes are stored in
+``<gallery_snapshot_dir>/<demo name>.json``.
+
+In regular builds, a demo that has a snapshot is executed even if it does not match the
+sphinx-gallery ``filename_pattern``, and each remote device it creates is replaced by a
+:class:`ReplayDevice` returning the recorded results in order. Local devices are
+unaffected. Snapshots are matched against the executed circuits, so that a demo whose
+circuits changed since it was recorded fails with an explicit error instead of
+silently rendering stale results.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+from sphinx_gallery import gen_rst
+
+# devices that need network access, a running service or quantum hardware
+REMOTE_DEVICES = re.compile(r"^(forest\.(qvm|qpu|wavefunction)|qiskit\.ibmq|braket\.aws\.|ionq\.)")
+
+# capabilities that would let PennyLane swap the replay device for another device
+_IGNORED_CAPABILITIES = ("passthru_devices", "passthru_interface")
+
+
+class SnapshotError(Exception):
+    """Raised when the recorded snapshot of a demo does not match its execution."""
+
+
+def snapshot_file(snapshot_dir, src_file):
+    """Path of the snapshot of a demo."""
+    name = os.path.splitext(os.path.basename(src_file))[0]
+    return os.path.join(snapshot_dir, name + ".json")
+
+
+def circuit_key(circuit):
+    """Hash of the structure of a circuit, independent of its parameter values.
+
+    Args:
+        circuit (pennylane.CircuitGraph or pennylane.tape.QuantumTape): the circuit
+
+    Returns:
+        str: the SHA-256 hex digest of the operations, wires and measured observables
+    """
+    ops = ["{}{}".format(op.name, op.wires.tolist()) for op in circuit.operations]
+    obs = [
+        "{}{}{}".format(ob.return_type, ob.name, ob.wires.tolist()) for ob in circuit.observables
+    ]
+    return hashlib.sha256("|".join(ops + ["||"] + obs).encode()).hexdigest()
+
+
+def encode(value):
+    """JSON-serializable representation of a device result."""
+    value = np.asarray(value)
+
+    if value.dtype == object:
+        return {"items": [encode(v) for v in value]}
+
+    if np.iscomplexobj(value):
+        data = [value.real.ravel().tolist(), value.imag.ravel().tolist()]
+    else:
+        data = value.ravel().tolist()
+
+    return {"dtype": str(value.dtype), "shape": list(value.shape), "data": data}
+
+
+def decode(value):
+    """Device result from its JSON-serializable representation."""
+    if "items" in value:
+        items = [decode(v) for v in value["items"]]
+        res = np.empty(len(items), dtype=object)
+        res[:] = items
+        return res
+
+    if np.issubdtype(np.dtype(value["dtype"]), np.complexfloating):
+        real, imag = value["data"]
+        data = np.array(real) + 1j * np.array(imag)
+    else:
+        data = np.array(value["data"])
+
+    return data.astype(value["dtype"]).reshape(value["shape"])
+
+
+def device_metadata(dev):
+    """Attributes of a device needed to build a :class:`ReplayDevice` behaving like it."""
+    capabilities = {
+        key: value
+        for key, value in dev.capabilities().items()
+        if key not in _IGNORED_CAPABILITIES
+        and isinstance(value, (bool, int, float, str, type(None)))
+    }
+
+    return {
+        "name": dev.short_name,
+        "wires": dev.wires.tolist(),
+        "shots": dev.shots,
+        "analytic": getattr(dev, "analytic", True),
+        "operations": sorted(dev.operations),
+        "observables": sorted(dev.observables),
+        "capabilities": capabilities,
+        "executions": [],
+    }
+
+
+def record_executions(dev, snapshot):
+    """Record the results of all the circuits executed by a device.
+
+    Args:
+        dev (pennylane.QubitDevice): the device
+        snapshot (dict): the snapshot of the device, as returned by :func:`device_metadata`
+    """
+    execute = dev.execute
+    batch_execute = dev.batch_execute
+    # batch_execute may itself call execute; only the outermost call is recorded
+    depth = [0]
+
+    def record(circuit, res):
+        snapshot["executions"].append({"circuit": circuit_key(circuit), "result": encode(res)})
+
+    def recording_execute(circuit, **kwargs):
+        depth[0] += 1
+        try:
+            res = execute(circuit, **kwargs)
+        finally:
+            depth[0] -= 1
+
+        if depth[0] == 0:
+            record(circuit, res)
+
+        return res
+
+    def recording_batch_execute(circuits):
+        depth[0] += 1
+        try:
+            results = batch_execute(circuits)
+        finally:
+            depth[0] -= 1
+
+        if depth[0] == 0:
+            for circuit, res in zip(circuits, results):
+                record(circuit, res)
+
+        return results
+
+    dev.execute = recording_execute
+    dev.batch_execute = recording_batch_execute
+
+
+def _replay_device_class():
+    # PennyLane is only imported once a demo creates a device
+    from pennylane.devices.default_qubit import (  # pylint: disable=import-outside-toplevel
+        DefaultQubit,
+    )
+
+    class ReplayDevice(DefaultQubit):
+        """Device returning the results recorded in a snapshot, in order.
+
+        Args:
+            snapshot (dict): the snapshot of the device, as recorded by
+                :func:`record_executions`
+        """
+
+        name = "Replay device for recorded gallery snapshots"
+        short_name = "gallery.replay"
+
+        def __init__(self, snapshot):
+            super().__init__(
+                wires=snapshot["wires"], shots=snapshot["shots"], analytic=snapshot["analytic"]
+            )
+            self.snapshot = snapshot
+            self.short_name = snapshot["name"]
+            self._executions = iter(snapshot["executions"])
+
+        @property
+        def operations(self):
+            return set(self.snapshot["operations"])
+
+        @property
+        def observables(self):
+            return set(self.snapshot["observables"])
+
+        def capabilities(self):  # pylint: disable=arguments-differ
+            return self.snapshot["capabilities"]
+
+        def execute(self, circuit, **kwargs):
+            execution = next(self._executions, None)
+
+            if execution is None:
+                raise SnapshotError(
+                    "{} executed more circuits than were recorded; record the snapshot "
+                    "again with 'make record-snapshots'".format(self.short_name)
+                )
+
+            if execution["circuit"] != circuit_key(circuit):
+                raise SnapshotError(
+                    "{} executed a circuit that differs from the recorded one; record the "
+                    "snapshot again with 'make record-snapshots'".format(self.short_name)
+                )
+
+            self._num_executions += 1
+            return decode(execution["result"])
+
+        def batch_execute(self, circuits):
+            return [self.execute(circuit) for circuit in circuits]
+
+    return ReplayDevice
+
+
+@contextlib.contextmanager
+def snapshots(snapshot_dir, mode="replay"):
+    """Context manager within which the remote devices of the demos executed by
+    sphinx-gallery are recorded to or replayed from their snapshots.
+
+    Args:
+        snapshot_dir (str): absolute path of the directory containing the snapshots
+        mode (str): ``"record"`` to execute the remote devices and record their results,
+            ``"replay"`` to replay the recorded snapshots, or ``"off"``
+    """
+    if mode == "off":
+        yield
+        return
+
+    execute_script = gen_rst.execute_script
+    executable_script = gen_rst.executable_script
+
+    def snapshot_executable_script(src_file, gallery_conf):
+        if executable_script(src_file, gallery_conf):
+            return True
+
+        # demos with a snapshot can be executed without their remote devices
+        return (
+            mode == "replay"
+            and bool(gallery_conf["plot_gallery"])
+            and os.path.isfile(snapshot_file(snapshot_dir, src_file))
+        )
+
+    def snapshot_execute_script(script_blocks, script_vars, gallery_conf):
+        path = snapshot_file(snapshot_dir, script_vars["src_file"])
+
+        if not script_vars["execute_script"]:
+            return execute_script(script_blocks, script_vars, gallery_conf)
+
+        if mode == "replay" and not os.path.isfile(path):
+            return execute_script(script_blocks, script_vars, gallery_conf)
+
+        import pennylane as qml  # pylint: disable=import-outside-toplevel
+
+        load_device = qml.device
+
+        if mode == "replay":
+            with open(path, "r") as f:
+                recorded = iter(json.load(f)["devices"])
+
+            replay_device = _replay_device_class()
+
+            def device(name, *args, **kwargs):
+                if not REMOTE_DEVICES.match(name):
+                    return load_device(name, *args, **kwargs)
+
+                snapshot = next(recorded, None)
+
+                if snapshot is None or snapshot["name"] != name:
+                    raise SnapshotError(
+                        "{} has no recorded snapshot of a {} device; record the snapshot "
+                        "again with 'make record-snapshots'".format(path, name)
+                    )
+
+                return replay_device(snapshot)
+
+        else:
+            recorded = []
+
+            def device(name, *args, **kwargs):
+                dev = load_device(name, *args, **kwargs)
+
+                if REMOTE_DEVICES.match(name) and isinstance(dev, qml.QubitDevice):
+                    recorded.append(device_metadata(dev))
+                    record_executions(dev, recorded[-1])
+
+                return dev
+
+        qml.device = device
+
+        try:
+            res = execute_script(script_blocks, script_vars, gallery_conf)
+        finally:
+            qml.device = load_device
+
+        if mode == "record" and recorded and script_vars["execute_script"]:
+            os.makedirs(snapshot_dir, exist_ok=True)
+
+            with open(path, "w") as f:
+                json.dump({"devices": recorded}, f)
+
+        return res
+
+    gen_rst.execute_script = snapshot_execute_script
+    gen_rst.executable_script = snapshot_executable_script
+
+    try:
+        yield
+    finally:
+        gen_rst.execute_script = execute_script
+        gen_rst.executable_script = executable_script
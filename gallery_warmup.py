@@ -0,0 +1,60 @@
+"""Warm interpreters for executing the gallery demos in parallel.
+
+Most demos start by importing one or more heavy frameworks (PennyLane, TensorFlow,
+PyTorch, Strawberry Fields, Cirq, Qiskit, PySCF, ...), which takes several seconds per
+demo when every demo runs in a freshly started interpreter. If ``gallery_preload`` lists
+these frameworks, the worker processes executing the demos are forked from a server
+process that imported this module, and therefore every listed framework, once. Each
+demo then runs in a copy-on-write child of this warm interpreter and only pays for its
+own work.
+
+The frameworks to import are passed to the server process through the
+``GALLERY_PRELOAD`` environment variable, and the time taken to import each of them is
+kept in :data:`import_times`, so that the build can report which ones dominate.
+
+Frameworks are only imported here, never initialized: forking a process in which, for
+instance, a TensorFlow session or CUDA context already exists is not supported.
+"""
+import importlib
+import os
+import time
+
+PRELOAD_ENV = "GALLERY_PRELOAD"
+
+
+def warm_up(modules):
+    """Import modules, recording how long each import takes.
+
+    Modules are imported in order, so that the time of a module does not include the
+    dependencies it shares with the modules imported before it.
+
+    Args:
+        modules (Sequence[str]): names of the modules to import
+
+    Returns:
+        dict[str, float or None]: the import time of each module in seconds, or ``None``
+        if it could not be imported
+    """
+    times = {}
+
+    if any(name.split(".")[0] == "matplotlib" for name in modules):
+        # sphinx-gallery requires the agg backend to be selected before pyplot is imported
+        import matplotlib  # pylint: disable=import-outside-toplevel
+
+        matplotlib.use("agg")
+
+    for name in modules:
+        start = time.perf_counter()
+
+        try:
+            importlib.import_module(name)
+        except Exception:  # pylint: disable=broad-except
+            times[name] = None
+            continue
+
+        times[name] = time.perf_counter() - start
+
+    return times
+
+
+import_times = warm_up([name for name in os.environ.get(PRELOAD_ENV, "").split(",") if name])
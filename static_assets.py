@@ -0,0 +1,395 @@
+"""Sphinx extension that optimizes the images of the built website.
+
+Figures and static images are copied verbatim into the HTML output by Sphinx. When
+``assets_optimize`` is enabled, the following stage is run on the PNG and JPEG images in
+the ``_images`` and ``_static`` output directories at the end of every HTML build:
+
+* PNG images are re-encoded losslessly with maximal compression, and replace the
+  original if smaller,
+* a WebP variant of every image is generated (lossless for PNG images), and kept if it
+  is smaller than the image,
+* a fingerprinted copy of every image and variant (``name.<hash>.ext``) is written next
+  to it, so that it can be served with a long-lived cache policy, and
+* every ``<img>`` of the HTML pages and theme templates referring to one of these images
+  is rewritten to the fingerprinted copy, inside a ``<picture>`` element offering the
+  WebP variant to the browsers that support it.
+
+The unprocessed images are left in place under their original names, so that links to
+them and references from stylesheets keep working. Processed images are cached in
+``assets_cache_dir``, keyed on their contents, so that only new or modified images are
+processed by later builds.
+
+Usage:
+
+.. code-block:: console
+
+    make html-release
+"""
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from sphinx.util import logging
+
+logger = logging.getLogger(__name__)
+
+# incremented whenever the processing of the images changes
+PIPELINE_VERSION = 1
+
+ASSET_DIRS = ("_images", "_static")
+RASTER_EXTENSIONS = (".png", ".jpg", ".jpeg")
+META_FILE = "meta.json"
+
+IMG_TAG = re.compile(r"<img\b[^>]*?\bsrc=\"([^\"]+)\"[^>]*>", re.IGNORECASE)
+FINGERPRINTED = re.compile(r"\.[0-9a-f]{10}$")
+
+
+def content_hash(data):
+    """SHA-256 hex digest of some bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def optimize_png(img):
+    """Losslessly re-encode a PNG image with maximal compression.
+
+    Args:
+        img (PIL.Image.Image): the image
+
+    Returns:
+        bytes: the encoded image
+    """
+    params = {"optimize": True}
+
+    for key in ("transparency", "dpi", "icc_profile"):
+        if key in img.info:
+            params[key] = img.info[key]
+
+    buf = io.BytesIO()
+    img.save(buf, "PNG", **params)
+    return buf.getvalue()
+
+
+def webp_variant(img, lossless):
+    """WebP encoding of an image.
+
+    Args:
+        img (PIL.Image.Image): the image
+        lossless (bool): whether to use lossless compression
+
+    Returns:
+        bytes or None: the encoded image, or ``None`` if its mode cannot be encoded as WebP
+    """
+    if img.mode in ("P", "LA", "PA"):
+        img = img.convert("RGBA")
+    elif img.mode in ("1", "L", "CMYK"):
+        img = img.convert("RGB")
+
+    if img.mode not in ("RGB", "RGBA"):
+        return None
+
+    buf = io.BytesIO()
+
+    if lossless:
+        img.save(buf, "WEBP", lossless=True, method=6)
+    else:
+        img.save(buf, "WEBP", quality=90, method=6)
+
+    return buf.getvalue()
+
+
+def process_image(data, ext):
+    """Optimized encoding and WebP variant of an image.
+
+    Args:
+        data (bytes): the contents of the image file
+        ext (str): the extension of the image file
+
+    Returns:
+        tuple[bytes, bytes or None]: the optimized image, which is the original if it
+        could not be made smaller, and the WebP variant if it is smaller
+    """
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+
+    with Image.open(io.BytesIO(data)) as img:
+        if getattr(img, "is_animated", False):
+            return data, None
+
+        optimized = data
+        is_png = ext == ".png"
+
+        if is_png:
+            candidate = optimize_png(img)
+
+            if len(candidate) < len(data):
+                optimized = candidate
+
+        webp = webp_variant(img, lossless=is_png)
+
+    if webp is not None and len(webp) >= len(optimized):
+        webp = None
+
+    return optimized, webp
+
+
+class AssetCache:
+    """On-disk cache of processed images, keyed on the contents of the original.
+
+    Args:
+        path (str): directory containing the cache
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def entry(self, key):
+        """Directory of the cache entry with the given key."""
+        return os.path.join(self.path, key[:2], key)
+
+    def load(self, key):
+        """Processed image with the given key, as returned by :func:`process_image`, or
+        ``None`` if it is not in the cache."""
+        entry = self.entry(key)
+        meta_file = os.path.join(entry, META_FILE)
+
+        if not os.path.isfile(meta_file):
+            return None
+
+        with open(meta_file, "r") as f:
+            meta = json.load(f)
+
+        with open(os.path.join(entry, "optimized"), "rb") as f:
+            optimized = f.read()
+
+        webp = None
+        if meta["webp"]:
+            with open(os.path.join(entry, "webp"), "rb") as f:
+                webp = f.read()
+
+        return optimized, webp
+
+    def store(self, key, optimized, webp):
+        """Store a processed image."""
+        entry = self.entry(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(entry))
+
+        try:
+            with open(os.path.join(tmp, "optimized"), "wb") as f:
+                f.write(optimized)
+
+            if webp is not None:
+                with open(os.path.join(tmp, "webp"), "wb") as f:
+                    f.write(webp)
+
+            with open(os.path.join(tmp, META_FILE), "w") as f:
+                json.dump({"webp": webp is not None}, f)
+
+            # an entry without metadata was left behind by an interrupted build
+            if os.path.isdir(entry) and not os.path.isfile(os.path.join(entry, META_FILE)):
+                shutil.rmtree(entry, ignore_errors=True)
+
+            try:
+                os.rename(tmp, entry)
+            except OSError:
+                # the entry was stored concurrently; entries with the same key have the
+                # same contents, so the temporary one is simply discarded
+                if not os.path.isdir(entry):
+                    raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def write_if_changed(path, data):
+    """Write a file, leaving it untouched if its contents are already identical."""
+    if os.path.isfile(path):
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return
+
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def fingerprinted(path, data):
+    """Path of the fingerprinted copy of a file with the given contents."""
+    stem, ext = os.path.splitext(path)
+    return "{}.{}{}".format(stem, content_hash(data)[:10], ext)
+
+
+def output_images(outdir):
+    """Raster images of the HTML output that are not fingerprinted copies."""
+    images = []
+
+    for asset_dir in ASSET_DIRS:
+        for root, _, files in os.walk(os.path.join(outdir, asset_dir)):
+            for fname in files:
+                stem, ext = os.path.splitext(fname)
+
+                if ext.lower() in RASTER_EXTENSIONS and not FINGERPRINTED.search(stem):
+                    images.append(os.path.join(root, fname))
+
+    return sorted(images)
+
+
+def image_key(data):
+    """Cache key of an image with the given contents."""
+    return content_hash("v{}|".format(PIPELINE_VERSION).encode() + data)
+
+
+def group_images(paths):
+    """Group images with identical contents, such as the copies of a static image in
+    ``_images``, so that each of them is processed only once.
+
+    Args:
+        paths (Sequence[str]): paths of the images
+
+    Returns:
+        list[list[str]]: the paths of the images with the same contents
+    """
+    groups = {}
+
+    for path in paths:
+        with open(path, "rb") as f:
+            groups.setdefault(image_key(f.read()), []).append(path)
+
+    return list(groups.values())
+
+
+def optimize_image(paths, cache):
+    """Optimize images of the HTML output with identical contents in place, and write
+    their fingerprinted copies and WebP variants.
+
+    Args:
+        paths (Sequence[str]): paths of the images, which all have the same contents
+        cache (AssetCache): the cache of processed images
+
+    Returns:
+        list[tuple[str, str or None]]: paths of the fingerprinted image and WebP variant
+        of each image
+    """
+    with open(paths[0], "rb") as f:
+        data = f.read()
+
+    ext = os.path.splitext(paths[0])[1].lower()
+    key = image_key(data)
+    processed = cache.load(key)
+
+    if processed is None:
+        # optimized images are processed again on later builds if Sphinx copies the
+        # original over them, so they are cached under their own key as well
+        processed = process_image(data, ext)
+        cache.store(key, *processed)
+
+        if processed[0] != data:
+            cache.store(image_key(processed[0]), *processed)
+
+    optimized, webp = processed
+    results = []
+
+    for path in paths:
+        write_if_changed(path, optimized)
+
+        image = fingerprinted(path, optimized)
+        write_if_changed(image, optimized)
+        variant = None
+
+        if webp is not None:
+            variant = fingerprinted(os.path.splitext(path)[0] + ".webp", webp)
+            write_if_changed(variant, webp)
+
+        results.append((image, variant))
+
+    return results
+
+
+def rewrite_html(html_file, images):
+    """Refer to the fingerprinted images and their WebP variants in an HTML page.
+
+    Args:
+        html_file (str): path of the HTML page
+        images (dict[str, tuple[str, str or None]]): the fingerprinted image and WebP
+            variant of each original image, keyed by its path
+
+    Returns:
+        bool: whether the page was modified
+    """
+    html_dir = os.path.dirname(html_file)
+
+    def replace(match):
+        tag, src = match.group(0), match.group(1)
+
+        if "://" in src or src.startswith(("/", "data:")):
+            return tag
+
+        path = os.path.normpath(os.path.join(html_dir, src.split("?")[0].split("#")[0]))
+
+        if path not in images:
+            return tag
+
+        image, variant = images[path]
+        rel = os.path.relpath(image, html_dir).replace(os.sep, "/")
+        tag = tag.replace('src="{}"'.format(src), 'src="{}"'.format(rel), 1)
+
+        if variant is None:
+            return tag
+
+        srcset = os.path.relpath(variant, html_dir).replace(os.sep, "/")
+        return '<picture><source srcset="{}" type="image/webp">{}</picture>'.format(srcset, tag)
+
+    with open(html_file, "r", encoding="utf-8") as f:
+        content = f.read()
+
+    new_content = IMG_TAG.sub(replace, content)
+
+    if new_content == content:
+        return False
+
+    with open(html_file, "w", encoding="utf-8") as f:
+        f.write(new_content)
+
+    return True
+
+
+def optimize_assets(app, exception):
+    """Optimize the images of the HTML output at the end of the build."""
+    if exception is not None or not app.config.assets_optimize or app.builder.format != "html":
+        return
+
+    try:
+        import PIL  # pylint: disable=import-outside-toplevel,unused-import
+    except ImportError:
+        logger.warning("assets_optimize requires Pillow; the images are left unoptimized")
+        return
+
+    cache = AssetCache(os.path.join(app.srcdir, app.config.assets_cache_dir))
+    groups = group_images(output_images(app.outdir))
+
+    with ThreadPoolExecutor() as pool:
+        processed = list(pool.map(lambda paths: optimize_image(paths, cache), groups))
+
+    images = {
+        path: result
+        for paths, results in zip(groups, processed)
+        for path, result in zip(paths, results)
+    }
+    rewritten = 0
+
+    for root, _, files in os.walk(app.outdir):
+        for fname in files:
+            if fname.endswith(".html") and rewrite_html(os.path.join(root, fname), images):
+                rewritten += 1
+
+    logger.info("optimized %d images, and updated %d HTML pages", len(images), rewritten)
+
+
+def setup(app):
+    """Register the extension with Sphinx."""
+    app.add_config_value("assets_optimize", False, "html")
+    app.add_config_value("assets_cache_dir", "_build/asset_cache", "html")
+    app.connect("build-finished", optimize_assets)
+    return {"parallel_read_safe": True, "parallel_write_safe": True}